@@ -1,190 +1,530 @@
-import csv
-import numpy as np
-
-class Clusters:
-    '''
-    Class that stores the properties of a cluster such as
-    cluster_id, the members (guest_id) in that cluster and center of mass
-    or the average of each column elements in that cluster
-    '''
-    def __init__(self, cluster_id, members, center_of_mass):
-        self.cluster_id = cluster_id
-        self.members = members
-        self.center_of_mass = center_of_mass
-
-class Agglomerative:
-    '''
-    Class that contains the entire process of agglomerative clustering
-    Each task is carried out by an individual function
-    '''
-    def initialize_clusters(self, data):
-        '''
-        Function that forms initial clusters from the given data
-        :param data: the actual dataset that is given as an input
-        :return: a dictionary in which the keys are 'cluster_ids' and values are the objects of
-        class 'Clusters'
-        '''
-        # initialize an empty dictionary
-        clusters_dict = {}
-        # add information to the Clusters object and add it to the dictionary
-        for row in data:
-            members = []
-            # add members
-            members.append(row[0])
-            # add center of mass which is entire record except for guest_id
-            center_of_mass = row[1:]
-            # create a new object
-            cl = Clusters(row[0], members, center_of_mass)
-            # add the object to the dictionary
-            clusters_dict[row[0]] = cl
-        # return the dictionary
-        return clusters_dict
-
-    def calculate_minimum_distance(self, clusters_dict):
-        '''
-        Function that calculates the minimum distance between two clusters
-        :param clusters_dict: the dictionary containing the objects of type 'Clusters'
-        :return: the ids of 2 clusters between which the distance is minimum
-        '''
-        # initialize variables
-        min1 = -1.0
-        min2 = -1.0
-        min_euclidean_distance = 9999999
-        # iterate through each key in the dictionary
-        for id1 in clusters_dict.keys():
-            # get the center of mass of that cluster into a list to calculate the distance
-            list1 = clusters_dict[id1].center_of_mass
-            # convert the list to a numpy array
-            list1 = np.array(list1)
-            # iterate through each key in the dictionary
-            for id2 in clusters_dict.keys():
-                # this may cause wrong results
-                # compute distance only if it has not been calculated previously
-                if id1 < id2:
-                    # get the center of mass of that cluster into a list to calculate the distance
-                    list2 = clusters_dict[id2].center_of_mass
-                    # convert the list to a numpy array
-                    list2 = np.array(list2)
-                    # calculate the euclidean distance using numpy function
-                    euclidean_distance = np.linalg.norm(list1 - list2)
-                    # keep track of the minimum distance and the cluster ids
-                    if euclidean_distance < min_euclidean_distance:
-                        min_euclidean_distance = euclidean_distance
-                        min1 = id1
-                        min2 = id2
-                #print('Distance between ', data[id1][0], ' and ', data[id2][0], ' is ', euclidean_distance)
-        #print('Min euc dist ', min_euclidean_distance, ' min1 ', min1, ' min2 ', min2)
-        # return the ids
-        return min1, min2
-
-    def calculate_center_of_mass(self, members_count1, current_center_of_mass1, members_count2, current_center_of_mass2):
-        '''
-        Function that calculates the center of mass for a given set of records
-        It uses the weighted average technique to calculate the new average or the
-        new center of mass
-        :param members_count1: used as a weight which will be multiplied to the center of mass of the first cluster
-        :param current_center_of_mass1: center of mass of the first cluster
-        :param members_count2: used as a weight which will be multiplied to the center of mass of the second cluster
-        :param current_center_of_mass2: center of mass of the second cluster
-        :return: return the centre of mass for a single cluster formed out of the two clusters
-        provided as input
-        '''
-        #2D list that will be converted to 2D numpy array
-        avg = []
-        # add the center of mass of first cluster, once for each element in the cluster (weighted average)
-        for num in range(0, members_count1):
-            avg.append(current_center_of_mass1)
-        # add the center of mass of second cluster, once for each element in the cluster (weighted average)
-        for num in range(0, members_count2):
-            avg.append(current_center_of_mass2)
-        # convert 2D list to 2D numpy array to calculate the mean
-        avg = np.array(avg)
-        # return the center of mass for the new cluster
-        return np.mean(avg, axis=0).tolist()
-
-    def form_clusters(self, data):
-        '''
-        Function that forms clusters from individual elements
-        :param data: the dataset that is provided as the input
-        :return: None
-        '''
-
-        # initializing clusters
-        stage = 1
-        clusters_dict = self.initialize_clusters(data)
-        # loop till we get only a single cluster
-        while(len(clusters_dict)!=1):
-            print('\nNumber of clusters: ', len(clusters_dict))
-            # finding minimum distance between two clusters
-            key1, key2 = self.calculate_minimum_distance(clusters_dict)
-
-            # obtaining the values that are necessary to calculate the new center of mass
-            members_count1 = len(clusters_dict[key1].members)
-            members_count2 = len(clusters_dict[key2].members)
-            current_center_of_mass1 = clusters_dict[key1].center_of_mass
-            current_center_of_mass2 = clusters_dict[key2].center_of_mass
-
-            # calculating the new center of mass for the merged clusters
-            new_center_of_mass = self.calculate_center_of_mass(members_count1, current_center_of_mass1, members_count2, current_center_of_mass2)
-
-            # store the center of mass on the element with minimum index
-            clusters_dict[key1].center_of_mass = new_center_of_mass
-            print(clusters_dict[key1].cluster_id, ' >>> ', clusters_dict[key1].members, ' merged with ')
-            # change made here
-            #clusters_dict[key1].members.append(key2)
-
-            print(clusters_dict[key2].cluster_id, ' >>> ', clusters_dict[key2].members)
-
-            # print the smaller cluster size
-            if len(clusters_dict[key1].members) < len(clusters_dict[key2].members):
-                print('Smaller cluster is ', key1,' size', len(clusters_dict[key1].members))
-                #print('Stage ', stage, ' size ', len(clusters_dict[key1].members))
-            elif len(clusters_dict[key1].members) > len(clusters_dict[key2].members):
-                print('Smaller cluster is ', key2,' size', len(clusters_dict[key2].members))
-                #print('Stage ', stage, ' size ', len(clusters_dict[key2].members))
-            else:
-                print('Equal size clusters', len(clusters_dict[key2].members),' ', len(clusters_dict[key2].members))
-                #print('Stage ', stage, ' size ', len(clusters_dict[key2].members))
-
-            # merging the members of two clusters
-            for num in range(0, len(clusters_dict[key2].members)):
-                clusters_dict[key1].members.append(clusters_dict[key2].members[num])
-
-            # pop the cluster with the higher cluster_id
-            clusters_dict.pop(key2)
-            stage += 1
-
-        print('\nNumber of clusters: ', len(clusters_dict))
-        size = 0
-        # print the elements of last cluster
-        for key in clusters_dict.keys():
-            print(clusters_dict[key].cluster_id, ' >>> ', clusters_dict[key].members)
-            size = len(clusters_dict[key].members)
-        print('Size of cluster: ', size)
-
-
-    def main(self):
-        '''
-        main function which gets the data from the csv file
-        :return:
-        '''
-        # path of the csv file
-        path = 'C:/abc.csv'
-        # read the file into a list
-        data = list(csv.reader(open(path)))
-
-        # casting from string to float
-        for row in range(1,len(data)):
-            for col in range(0, len(data[1])):
-                data[row][col] = float(data[row][col])
-
-        # removing headers
-        data.pop(0)
-
-        # forming clusters
-        self.form_clusters(data)
-
-# creating an object of type 'Agglomerative'
-agg = Agglomerative()
-# call to the main function
-agg.main()
+import csv
+import heapq
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from cluster_statistics import cluster_statistics, summary_table
+
+# layout of a merge in the files written by save_linkage
+LINKAGE_DTYPE = np.dtype([('id1', '<i4'), ('id2', '<i4'), ('distance', '<f8'), ('size', '<i4')])
+
+class CondensedDistanceMatrix:
+    '''
+    Class that stores the upper triangle of a symmetric distance matrix in a single 1D array
+    The distance between i and j (i < j) is stored at position n*i - i*(i+1)/2 + (j - i - 1),
+    so the distances from i to all the higher indices form one contiguous slice.
+    The array can optionally be a numpy memmap so that it lives on disk instead of in memory,
+    or a shared memory block so that worker processes can fill it
+    '''
+    def __init__(self, size, dtype=np.float64, path=None, shared=False):
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self.shared_memory = None
+        length = size * (size - 1) // 2
+        if path is not None:
+            # a memmap of length 0 is not allowed
+            self.values = np.memmap(path, dtype=dtype, mode='w+', shape=(max(length, 1),))
+            self.location = ('memmap', path)
+        elif shared:
+            self.shared_memory = shared_memory.SharedMemory(create=True, size=max(length, 1) * self.dtype.itemsize)
+            self.values = np.ndarray((length,), dtype=dtype, buffer=self.shared_memory.buf)
+            self.location = ('shared', self.shared_memory.name)
+        else:
+            self.values = np.empty(length, dtype=dtype)
+            self.location = None
+
+    def close(self):
+        '''
+        Function that releases the shared memory block, if any
+        :return: None
+        '''
+        if self.shared_memory is not None:
+            # the array has to be dropped before the buffer can be closed
+            self.values = None
+            self.shared_memory.close()
+            self.shared_memory.unlink()
+            self.shared_memory = None
+
+    def positions(self, index, others):
+        '''
+        Function that calculates the positions of the distances between index and each element of others
+        :param index: index of a record
+        :param others: numpy array of indices that are different from index
+        :return: numpy array of positions in the condensed array
+        '''
+        others = np.asarray(others, dtype=np.int64)
+        low = np.minimum(others, index)
+        high = np.maximum(others, index)
+        return self.size * low - low * (low + 1) // 2 + (high - low - 1)
+
+    def row(self, index):
+        '''
+        Function that returns the distances from index to every higher index
+        :param index: index of a record
+        :return: a view into the condensed array, writing to it updates the matrix
+        '''
+        start = self.size * index - index * (index + 1) // 2
+        return self.values[start:start + self.size - index - 1]
+
+    def remove(self, index):
+        '''
+        Function that sets every distance of the given index to inf so it is never picked again
+        :param index: index of a record
+        :return: None
+        '''
+        others = np.arange(0, index)
+        self.values[self.positions(index, others)] = np.inf
+        self.row(index)[:] = np.inf
+
+
+def fill_distance_rows(points, values, start, end):
+    '''
+    Function that fills the rows start to end-1 of a condensed matrix with squared euclidean distances
+    :param points: n x d array of records
+    :param values: the condensed array
+    :param start: first row to fill
+    :param end: row after the last row to fill
+    :return: None
+    '''
+    size = len(points)
+    position = size * start - start * (start + 1) // 2
+    # fill one row at a time so that the temporary array stays of size n x d
+    for index in range(start, end):
+        length = size - index - 1
+        values[position:position + length] = ((points[index + 1:] - points[index]) ** 2).sum(axis=1)
+        position += length
+
+
+# records used by the worker processes, set once per worker by init_distance_worker
+worker_points = None
+
+
+def init_distance_worker(points):
+    '''
+    Function that stores the records in a worker process so they are not sent with every block
+    :param points: n x d array of records
+    :return: None
+    '''
+    global worker_points
+    worker_points = points
+
+
+def fill_distance_block(location, dtype, start, end):
+    '''
+    Function run by a worker process that fills a block of rows directly in the shared output buffer
+    :param location: ('memmap', path) or ('shared', name) as stored in CondensedDistanceMatrix.location
+    :param dtype: float type of the condensed array
+    :param start: first row to fill
+    :param end: row after the last row to fill
+    :return: None
+    '''
+    size = len(worker_points)
+    length = size * (size - 1) // 2
+    if location[0] == 'memmap':
+        values = np.memmap(location[1], dtype=dtype, mode='r+', shape=(max(length, 1),))
+        fill_distance_rows(worker_points, values, start, end)
+        values.flush()
+        del values
+    else:
+        block = shared_memory.SharedMemory(name=location[1])
+        values = np.ndarray((length,), dtype=dtype, buffer=block.buf)
+        fill_distance_rows(worker_points, values, start, end)
+        del values
+        block.close()
+
+
+class Agglomerative:
+    '''
+    Class that contains the entire process of agglomerative clustering
+    Each task is carried out by an individual function
+    '''
+    def __init__(self, dtype=np.float64, memmap_path=None, method='centroid', n_jobs=1):
+        '''
+        :param dtype: float type used to store the distances, np.float32 halves the memory
+        :param memmap_path: if given, the distances are stored in a memmap file at this path
+        :param method: 'centroid' merges the clusters with the closest centers of mass,
+        'single' merges the clusters with the closest pair of members
+        :param n_jobs: number of processes used to calculate the initial distances
+        '''
+        if method not in ('centroid', 'single'):
+            raise ValueError('Unknown linkage method: ' + str(method))
+        self.dtype = dtype
+        self.memmap_path = memmap_path
+        self.method = method
+        self.n_jobs = n_jobs
+
+    def initialize_clusters(self, data):
+        '''
+        Function that forms initial clusters from the given data
+        Every record starts as its own cluster, the state of all the clusters is kept in flat arrays
+        :param data: the actual dataset that is given as an input
+        :return: centers: n x d array with the center of mass of the cluster stored at each index
+                 sizes: number of members of the cluster stored at each index
+                 parent: union-find parent array, the root of a record is the index of its cluster
+                 node_ids: id of the cluster stored at each index as used in the linkage matrix
+        '''
+        # center of mass is entire record except for guest_id
+        centers = np.array([row[1:] for row in data], dtype=np.float64)
+        sizes = np.ones(len(data), dtype=np.int64)
+        parent = np.arange(len(data))
+        node_ids = np.arange(len(data))
+        return centers, sizes, parent, node_ids
+
+    def calculate_distance_matrix(self, data):
+        '''
+        Function that calculates the squared euclidean distance between every pair of records
+        The squared distances are used because the Lance-Williams update for centroid linkage
+        is exact on squared distances.
+        With more than one job the rows are split into blocks holding about the same number of
+        distances and the blocks are filled by a process pool directly in the memmap or shared memory
+        :param data: the dataset that is provided as the input
+        :return: an object of class 'CondensedDistanceMatrix'
+        '''
+        # the center of mass of every record is the entire record except for guest_id
+        points = np.array([row[1:] for row in data], dtype=np.float64)
+        if self.n_jobs <= 1 or len(points) < 2:
+            distances = CondensedDistanceMatrix(len(points), self.dtype, self.memmap_path)
+            fill_distance_rows(points, distances.values, 0, len(points))
+            return distances
+
+        distances = CondensedDistanceMatrix(len(points), self.dtype, self.memmap_path, shared=True)
+        # row i starts at this position in the condensed array
+        starts = np.arange(len(points)) * len(points) - np.arange(len(points)) * (np.arange(len(points)) + 1) // 2
+        # a few blocks per job so that the processes finish at about the same time
+        bounds = np.searchsorted(starts, np.linspace(0, len(distances.values), self.n_jobs * 4 + 1))
+        bounds[-1] = len(points)
+        bounds = np.unique(bounds)
+        with ProcessPoolExecutor(max_workers=self.n_jobs, initializer=init_distance_worker, initargs=(points,)) as pool:
+            jobs = [pool.submit(fill_distance_block, distances.location, distances.dtype, int(start), int(end))
+                    for start, end in zip(bounds[:-1], bounds[1:])]
+            for job in jobs:
+                job.result()
+        return distances
+
+    def lance_williams_update(self, distance_ki, distance_kj, distance_ij, members_count1, members_count2):
+        '''
+        Function that calculates the distance from every cluster k to the cluster formed by merging i and j
+        using the Lance-Williams formula for centroid linkage
+        :param distance_ki: squared distances from every cluster to cluster i
+        :param distance_kj: squared distances from every cluster to cluster j
+        :param distance_ij: squared distance between cluster i and cluster j
+        :param members_count1: number of members in cluster i
+        :param members_count2: number of members in cluster j
+        :return: squared distances from every cluster to the merged cluster
+        '''
+        total = members_count1 + members_count2
+        alpha1 = members_count1 / total
+        alpha2 = members_count2 / total
+        beta = members_count1 * members_count2 / (total * total)
+        return alpha1 * distance_ki + alpha2 * distance_kj - beta * distance_ij
+
+    def update_nearest_neighbor(self, distances, index, nearest, min_distance, heap):
+        '''
+        Function that finds the nearest cluster with a higher index for the given cluster
+        and pushes the pair on the priority queue
+        :param distances: the squared distances as a 'CondensedDistanceMatrix'
+        :param index: index of the cluster whose nearest neighbor is to be found
+        :param nearest: array containing the nearest neighbor of each cluster
+        :param min_distance: array containing the distance to the nearest neighbor of each cluster
+        :param heap: priority queue of (distance, index1, index2) candidate merges
+        :return: None
+        '''
+        row = distances.row(index)
+        if len(row) == 0:
+            nearest[index] = -1
+            min_distance[index] = np.inf
+            return
+        # argmin returns the first minimum, so ties go to the lower index like the pairwise scan
+        offset = int(np.argmin(row))
+        nearest[index] = index + 1 + offset
+        min_distance[index] = row[offset]
+        if min_distance[index] != np.inf:
+            heapq.heappush(heap, (float(min_distance[index]), index, int(nearest[index])))
+
+    def calculate_center_of_mass(self, members_count1, current_center_of_mass1, members_count2, current_center_of_mass2):
+        '''
+        Function that calculates the center of mass for a given set of records
+        It uses the weighted average technique to calculate the new average or the
+        new center of mass
+        :param members_count1: used as a weight which will be multiplied to the center of mass of the first cluster
+        :param current_center_of_mass1: center of mass of the first cluster
+        :param members_count2: used as a weight which will be multiplied to the center of mass of the second cluster
+        :param current_center_of_mass2: center of mass of the second cluster
+        :return: return the centre of mass for a single cluster formed out of the two clusters
+        provided as input
+        '''
+        total = members_count1 + members_count2
+        return (members_count1 * current_center_of_mass1 + members_count2 * current_center_of_mass2) / total
+
+    def find_root(self, parent, index):
+        '''
+        Function that finds the index of the cluster a record belongs to in the union-find parent array
+        The path is halved on the way up so that later lookups are faster
+        :param parent: union-find parent array
+        :param index: index of a record
+        :return: index of the cluster containing the record
+        '''
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def get_members(self, linkage, node_id):
+        '''
+        Function that lists the records that belong to a cluster of the linkage matrix
+        :param linkage: (n-1) x 4 linkage matrix returned by form_clusters
+        :param node_id: id of the cluster, ids below n are single records and id n+i is formed at step i
+        :return: a list of the row indices of the members
+        '''
+        size = len(linkage) + 1
+        members = []
+        stack = [int(node_id)]
+        while stack:
+            node = stack.pop()
+            if node < size:
+                members.append(node)
+            else:
+                stack.append(int(linkage[node - size, 1]))
+                stack.append(int(linkage[node - size, 0]))
+        return members
+
+    def minimum_spanning_tree(self, data):
+        '''
+        Function that calculates the minimum spanning tree of the records using Prim's algorithm
+        Only the distance from each record to the tree is kept, so the memory used is O(n)
+        :param data: the dataset that is provided as the input
+        :return: (n-1) x 3 array of edges, each row holds the two records and the distance between them
+        '''
+        # the record used for the distances is the entire record except for guest_id
+        points = np.array([row[1:] for row in data], dtype=np.float64)
+        in_tree = np.zeros(len(points), dtype=bool)
+        # squared distance from each record to the closest record in the tree and that record
+        min_distance = np.full(len(points), np.inf)
+        source = np.zeros(len(points), dtype=np.int64)
+        edges = np.zeros((max(len(points) - 1, 0), 3))
+        current = 0
+        in_tree[current] = True
+        for step in range(0, len(edges)):
+            # distances from the record that was added last to every record
+            distance = ((points - points[current]) ** 2).sum(axis=1)
+            closer = (distance < min_distance) & ~in_tree
+            min_distance[closer] = distance[closer]
+            source[closer] = current
+            # the closest record outside the tree is added next
+            current = int(np.argmin(np.where(in_tree, np.inf, min_distance)))
+            edges[step] = [source[current], current, np.sqrt(min_distance[current])]
+            in_tree[current] = True
+        return edges
+
+    def single_linkage(self, data):
+        '''
+        Function that forms clusters with single linkage from the minimum spanning tree
+        Merging the edges of the tree from the shortest to the longest gives the single linkage dendrogram
+        :param data: the dataset that is provided as the input
+        :return: (n-1) x 4 linkage matrix in the same format as form_clusters
+        '''
+        edges = self.minimum_spanning_tree(data)
+        edges = edges[np.argsort(edges[:, 2], kind='stable')]
+        parent = np.arange(len(data))
+        sizes = np.ones(len(data), dtype=np.int64)
+        node_ids = np.arange(len(data))
+        linkage = np.zeros((len(edges), 4))
+        for stage in range(0, len(edges)):
+            root1 = self.find_root(parent, int(edges[stage, 0]))
+            root2 = self.find_root(parent, int(edges[stage, 1]))
+            linkage[stage] = [min(node_ids[root1], node_ids[root2]), max(node_ids[root1], node_ids[root2]),
+                              edges[stage, 2], sizes[root1] + sizes[root2]]
+            parent[root2] = root1
+            sizes[root1] += sizes[root2]
+            node_ids[root1] = len(data) + stage
+        return linkage
+
+    def form_clusters(self, data, n_clusters=1, distance_threshold=None):
+        '''
+        Function that forms clusters from individual elements
+        The pairwise distances are computed once and kept up to date with the Lance-Williams formula.
+        Every cluster keeps track of its nearest neighbor among the clusters with a higher index
+        and these candidates are stored in a priority queue, so a merge only rescans the rows
+        whose nearest neighbor was involved in the merge
+        :param data: the dataset that is provided as the input
+        :param n_clusters: stop merging when this many clusters are left
+        :param distance_threshold: if given, stop merging when the closest clusters are further apart than this
+        :return: linkage matrix with one row per merge, row i holds the ids of the two merged clusters,
+        the distance between them and the size of the new cluster which gets the id n+i
+        '''
+        if self.method == 'single':
+            # the spanning tree costs the same whether or not we stop early, so cut the full dendrogram
+            linkage = self.single_linkage(data)
+            return linkage[:self.count_merges(linkage, len(data), n_clusters, distance_threshold)]
+
+        # initializing clusters
+        centers, sizes, parent, node_ids = self.initialize_clusters(data)
+        distances = self.calculate_distance_matrix(data)
+        active = np.ones(len(data), dtype=bool)
+        nearest = np.full(len(data), -1, dtype=np.int64)
+        min_distance = np.full(len(data), np.inf)
+        heap = []
+        for index in range(0, len(data)):
+            self.update_nearest_neighbor(distances, index, nearest, min_distance, heap)
+
+        linkage = np.zeros((max(len(data) - n_clusters, 0), 4))
+        stage = 0
+        # loop till we get the requested number of clusters
+        while stage < len(linkage):
+            # finding minimum distance between two clusters
+            distance, index1, index2 = heapq.heappop(heap)
+            # skip the entries that were invalidated by previous merges
+            if not active[index1] or nearest[index1] != index2 or min_distance[index1] != distance:
+                continue
+            if distance_threshold is not None and np.sqrt(distance) > distance_threshold:
+                break
+
+            # obtaining the values that are necessary to calculate the new center of mass
+            members_count1 = sizes[index1]
+            members_count2 = sizes[index2]
+
+            # store the merged cluster on the element with minimum index
+            centers[index1] = self.calculate_center_of_mass(members_count1, centers[index1], members_count2, centers[index2])
+            sizes[index1] = members_count1 + members_count2
+            parent[index2] = index1
+            linkage[stage] = [min(node_ids[index1], node_ids[index2]), max(node_ids[index1], node_ids[index2]),
+                              np.sqrt(distance), sizes[index1]]
+            node_ids[index1] = len(data) + stage
+
+            # updating the distances from every cluster to the merged cluster in place
+            others = np.flatnonzero(active)
+            others = others[(others != index1) & (others != index2)]
+            position1 = distances.positions(index1, others)
+            position2 = distances.positions(index2, others)
+            distances.values[position1] = self.lance_williams_update(distances.values[position1], distances.values[position2],
+                                                                     distance, members_count1, members_count2)
+            # the cluster with the higher index no longer exists
+            distances.remove(index2)
+            active[index2] = False
+
+            # refreshing the nearest neighbors of the clusters affected by the merge
+            candidates = np.flatnonzero(active[:index2])
+            # clusters whose nearest neighbor took part in the merge have to rescan their row
+            stale = (nearest[candidates] == index1) | (nearest[candidates] == index2) | (candidates == index1)
+            for index in candidates[stale]:
+                self.update_nearest_neighbor(distances, index, nearest, min_distance, heap)
+            # the other clusters only need to check whether the merged cluster came closer
+            candidates = candidates[~stale & (candidates < index1)]
+            new_distance = distances.values[distances.positions(index1, candidates)]
+            closer = (new_distance < min_distance[candidates]) | \
+                     ((new_distance == min_distance[candidates]) & (index1 < nearest[candidates]))
+            for index, value in zip(candidates[closer], new_distance[closer]):
+                nearest[index] = index1
+                min_distance[index] = value
+                heapq.heappush(heap, (float(value), int(index), index1))
+
+            stage += 1
+
+        distances.close()
+        return linkage[:stage]
+
+    def count_merges(self, linkage, size, n_clusters=1, distance_threshold=None):
+        '''
+        Function that counts how many merges of the linkage matrix are applied before stopping
+        :param linkage: linkage matrix returned by form_clusters
+        :param size: number of records that were clustered
+        :param n_clusters: stop when this many clusters are left
+        :param distance_threshold: if given, stop at the first merge whose distance is above it
+        :return: number of merges
+        '''
+        count = min(len(linkage), max(size - n_clusters, 0))
+        if distance_threshold is not None:
+            # centroid linkage can have inversions, so stop at the first merge above the threshold
+            above = np.flatnonzero(linkage[:count, 2] > distance_threshold)
+            if len(above) > 0:
+                count = int(above[0])
+        return count
+
+    def cut_tree(self, linkage, size, n_clusters=1, distance_threshold=None):
+        '''
+        Function that cuts the dendrogram into flat clusters without recomputing any distance
+        :param linkage: linkage matrix returned by form_clusters or load_linkage
+        :param size: number of records that were clustered
+        :param n_clusters: number of clusters wanted
+        :param distance_threshold: if given, only the merges up to this distance are applied
+        :return: numpy array with the cluster number (0 to k-1) of every record
+        '''
+        parent = np.arange(size)
+        # record that represents each cluster id of the linkage matrix
+        representative = np.concatenate((np.arange(size), np.zeros(len(linkage), dtype=np.int64)))
+        for stage in range(0, self.count_merges(linkage, size, n_clusters, distance_threshold)):
+            root1 = self.find_root(parent, representative[int(linkage[stage, 0])])
+            root2 = self.find_root(parent, representative[int(linkage[stage, 1])])
+            parent[root2] = root1
+            representative[size + stage] = root1
+        roots = np.array([self.find_root(parent, index) for index in range(0, size)], dtype=np.int64)
+        # number the clusters in the order in which they first appear
+        _, first, labels = np.unique(roots, return_index=True, return_inverse=True)
+        return np.argsort(np.argsort(first))[labels]
+
+    def save_linkage(self, path, linkage, size):
+        '''
+        Function that saves the linkage matrix to a binary file
+        The file holds the number of records followed by one 20 byte record per merge
+        :param path: path of the file
+        :param linkage: linkage matrix returned by form_clusters
+        :param size: number of records that were clustered
+        :return: None
+        '''
+        merges = np.zeros(len(linkage), dtype=LINKAGE_DTYPE)
+        merges['id1'] = linkage[:, 0]
+        merges['id2'] = linkage[:, 1]
+        merges['distance'] = linkage[:, 2]
+        merges['size'] = linkage[:, 3]
+        with open(path, 'wb') as out_file:
+            np.array([size], dtype='<i8').tofile(out_file)
+            merges.tofile(out_file)
+
+    def load_linkage(self, path):
+        '''
+        Function that loads a linkage matrix saved by save_linkage
+        :param path: path of the file
+        :return: linkage: linkage matrix in the format returned by form_clusters
+                 size: number of records that were clustered
+        '''
+        with open(path, 'rb') as in_file:
+            size = int(np.fromfile(in_file, dtype='<i8', count=1)[0])
+            merges = np.fromfile(in_file, dtype=LINKAGE_DTYPE)
+        linkage = np.column_stack((merges['id1'], merges['id2'], merges['distance'], merges['size'])).astype(np.float64)
+        return linkage.reshape(-1, 4), size
+
+    def main(self):
+        '''
+        main function which gets the data from the csv file
+        :return:
+        '''
+        # path of the csv file
+        path = 'C:/abc.csv'
+        # read the file into a list
+        data = list(csv.reader(open(path)))
+
+        # casting from string to float
+        for row in range(1,len(data)):
+            for col in range(0, len(data[1])):
+                data[row][col] = float(data[row][col])
+
+        # removing headers
+        data.pop(0)
+
+        # forming clusters
+        linkage = self.form_clusters(data)
+        for stage in range(0, len(linkage)):
+            print('Number of clusters: ', len(data) - stage, ' merging ', int(linkage[stage, 0]), ' and ',
+                  int(linkage[stage, 1]), ' distance ', linkage[stage, 2], ' size ', int(linkage[stage, 3]))
+        # keep the merge history so that it can be cut at any number of clusters later
+        self.save_linkage('C:/abc_linkage.bin', linkage, len(data))
+        # summary of the clusters when the dendrogram is cut into 5 clusters, without the guest_id column
+        labels = self.cut_tree(linkage, len(data), n_clusters=5)
+        print(summary_table(cluster_statistics(np.asarray(data, dtype=np.float64)[:, 1:], labels)))
+
+if __name__ == '__main__':
+    # creating an object of type 'Agglomerative', the initial distances are computed on every core
+    agg = Agglomerative(n_jobs=os.cpu_count())
+    # call to the main function
+    agg.main()
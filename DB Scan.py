@@ -1,8 +1,965 @@
 import numpy as np
-import pandas as pd
 import csv
+import hashlib
+import heapq
+import os
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import matplotlib.pyplot as pplot
 from mpl_toolkits.mplot3d import axes3d
+from cluster_statistics import cluster_statistics, summary_table
+from grid_hash import CellIndex
+
+
+class SpatialIndex:
+    '''
+    Class that stores the data points in a binary tree of nodes so that a region query only
+    looks at the nodes that can contain points within eps.
+    Each node covers a contiguous range of the 'indices' array, a node is split in two at the
+    median of its widest dimension until it holds at most leaf_size points.
+    KDTree and BallTree only differ in the bound used to skip a node
+    '''
+    def __init__(self, data, leaf_size=40):
+        # contiguous copy of the data points
+        self.data = np.ascontiguousarray(data, dtype=np.float64)
+        self.leaf_size = leaf_size
+        # the points of node i are indices[start[i]:end[i]]
+        self.indices = np.arange(len(self.data))
+        start = [0]
+        end = [len(self.data)]
+        left = [-1]
+        right = [-1]
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if end[node] - start[node] <= leaf_size:
+                continue
+            members = self.indices[start[node]:end[node]]
+            points = self.data[members]
+            dim = np.argmax(points.max(axis=0) - points.min(axis=0))
+            order = np.argsort(points[:, dim], kind='stable')
+            self.indices[start[node]:end[node]] = members[order]
+            middle = start[node] + len(members) // 2
+            for child_start, child_end in ((start[node], middle), (middle, end[node])):
+                start.append(child_start)
+                end.append(child_end)
+                left.append(-1)
+                right.append(-1)
+                stack.append(len(start) - 1)
+            left[node] = len(start) - 2
+            right[node] = len(start) - 1
+        self.start = np.array(start)
+        self.end = np.array(end)
+        self.left = np.array(left)
+        self.right = np.array(right)
+        self.build_bounds()
+
+    def build_bounds(self):
+        '''
+        Function that calculates the bound of every node
+        :return: None
+        '''
+        raise NotImplementedError
+
+    def min_distance(self, node, points):
+        '''
+        Function that calculates a lower bound on the distance from each point to the points of a node
+        :param node: index of the node
+        :param points: m x d numpy array of query points
+        :return: numpy array of m lower bounds
+        '''
+        raise NotImplementedError
+
+    def query_pairs(self, points, eps):
+        '''
+        Function that finds every (query point, data point) pair closer than eps
+        All the query points go down the tree together, at each node only the query points
+        that can have a neighbor in it are kept, and at a leaf the distances are calculated at once
+        :param points: m x d numpy array of query points
+        :param eps: the radius of the query
+        :return: query_ids: index of the query point of each pair
+                 point_ids: index of the data point of each pair
+                 distances: distance between the two points of each pair
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1, self.data.shape[1])
+        query_ids = []
+        point_ids = []
+        distances = []
+        stack = [(0, np.arange(len(points)))]
+        while stack:
+            node, queries = stack.pop()
+            queries = queries[self.min_distance(node, points[queries]) <= eps]
+            if len(queries) == 0:
+                continue
+            if self.left[node] >= 0:
+                stack.append((self.right[node], queries))
+                stack.append((self.left[node], queries))
+                continue
+            members = self.indices[self.start[node]:self.end[node]]
+            # a block of query points at a time keeps the temporary array small
+            for first in range(0, len(queries), 1024):
+                block = queries[first:first + 1024]
+                distance = np.sqrt(((points[block][:, None, :] - self.data[members][None, :, :]) ** 2).sum(axis=2))
+                rows, cols = np.nonzero(distance < eps)
+                query_ids.append(block[rows])
+                point_ids.append(members[cols])
+                distances.append(distance[rows, cols])
+        if len(query_ids) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(query_ids), np.concatenate(point_ids), np.concatenate(distances)
+
+    def query_radius(self, points, eps):
+        '''
+        Function that finds the neighbors within eps of many points at once
+        :param points: m x d numpy array of query points
+        :param eps: the radius of the query
+        :return: a list with, for each query point, the sorted numpy array of the indices of its neighbors
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1, self.data.shape[1])
+        query_ids, point_ids, distances = self.query_pairs(points, eps)
+        # sort by query point and then by index, like a linear scan would return them
+        order = np.lexsort((point_ids, query_ids))
+        bounds = np.searchsorted(query_ids[order], np.arange(len(points) + 1))
+        point_ids = point_ids[order]
+        return [point_ids[bounds[num]:bounds[num + 1]] for num in range(0, len(points))]
+
+
+    def query_neighborhoods(self, eps, chunk_size=4096):
+        '''
+        Function that finds the neighbors within eps of every data point, chunk_size points going
+        down the tree together at a time
+        :param eps: the radius of the query
+        :param chunk_size: number of points queried at once
+        :return: indptr: numpy array, the neighbors of point i are indices[indptr[i]:indptr[i + 1]]
+                 indices: numpy array with the neighbors of all the points, sorted by index for each point
+        '''
+        counts = np.zeros(len(self.data), dtype=np.int64)
+        indices = []
+        for start in range(0, len(self.data), chunk_size):
+            chunk = self.data[start:start + chunk_size]
+            query_ids, point_ids, _ = self.query_pairs(chunk, eps)
+            order = np.lexsort((point_ids, query_ids))
+            counts[start:start + len(chunk)] = np.bincount(query_ids, minlength=len(chunk))
+            indices.append(point_ids[order])
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        return indptr, np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+
+
+class KDTree(SpatialIndex):
+    '''
+    Spatial index whose nodes are bounded by axis-aligned boxes, best for low dimensions
+    '''
+    def build_bounds(self):
+        '''
+        Function that calculates the bounding box of every node
+        :return: None
+        '''
+        self.lower = np.empty((len(self.start), self.data.shape[1]))
+        self.upper = np.empty((len(self.start), self.data.shape[1]))
+        for node in range(0, len(self.start)):
+            points = self.data[self.indices[self.start[node]:self.end[node]]]
+            self.lower[node] = points.min(axis=0)
+            self.upper[node] = points.max(axis=0)
+
+    def min_distance(self, node, points):
+        '''
+        Function that calculates the distance from each point to the bounding box of a node
+        :param node: index of the node
+        :param points: m x d numpy array of query points
+        :return: numpy array of m distances
+        '''
+        gap = np.maximum(np.maximum(self.lower[node] - points, points - self.upper[node]), 0)
+        return np.sqrt((gap ** 2).sum(axis=1))
+
+
+class BallTree(SpatialIndex):
+    '''
+    Spatial index whose nodes are bounded by balls, which prune better than boxes in higher dimensions
+    '''
+    def build_bounds(self):
+        '''
+        Function that calculates the center and radius of the ball of every node
+        :return: None
+        '''
+        self.center = np.empty((len(self.start), self.data.shape[1]))
+        self.radius = np.empty(len(self.start))
+        for node in range(0, len(self.start)):
+            points = self.data[self.indices[self.start[node]:self.end[node]]]
+            self.center[node] = points.mean(axis=0)
+            self.radius[node] = np.sqrt(((points - self.center[node]) ** 2).sum(axis=1).max())
+
+    def min_distance(self, node, points):
+        '''
+        Function that calculates the distance from each point to the ball of a node
+        :param node: index of the node
+        :param points: m x d numpy array of query points
+        :return: numpy array of m distances
+        '''
+        distance = np.sqrt(((points - self.center[node]) ** 2).sum(axis=1))
+        return np.maximum(distance - self.radius[node], 0)
+
+
+def build_index(data, leaf_size=40):
+    '''
+    This function builds the spatial index used for the region queries
+    :param data: input file
+    :param leaf_size: maximum number of points in a leaf
+    :return: a KDTree for up to 10 dimensions, a BallTree above that
+    '''
+    data = np.asarray(data, dtype=np.float64)
+    if data.shape[1] <= 10:
+        return KDTree(data, leaf_size)
+    return BallTree(data, leaf_size)
+
+
+# the number of neighboring cells grows like (2 ceil(sqrt(d)) + 1)^d, so the grid is only used up to this dimension
+GRID_MAX_DIMENSIONS = 4
+
+
+class Grid(CellIndex):
+    '''
+    Class that buckets the data points into cells of side eps/sqrt(d), so that any two points in the
+    same cell are closer than eps and the neighbors of a point can only be in the cells whose
+    offset from its own cell is at most ceil(sqrt(d)) along every dimension
+    '''
+    def __init__(self, data, eps, chunk_size=4096):
+        dims = np.shape(data)[1]
+        if dims > GRID_MAX_DIMENSIONS:
+            raise ValueError('the grid is limited to %d dimensions, the data has %d, use the tree backend'
+                             % (GRID_MAX_DIMENSIONS, dims))
+        self.eps = eps
+        # slightly smaller than eps/sqrt(d) so that rounding never puts two points eps apart in one cell
+        side = eps / np.sqrt(dims) * (1 - 1e-9)
+        reach = int(np.ceil(eps / side))
+        CellIndex.__init__(self, data, side, reach, eps, chunk_size=chunk_size)
+        # offsets of the cells that can hold a point within eps, the closest points of two cells
+        # that are o cells apart are (|o| - 1) cells apart along each dimension
+        self.offsets = []
+        for offset in itertools.product(range(-reach, reach + 1), repeat=dims):
+            gap = np.maximum(np.abs(np.array(offset)) - 1, 0) * side
+            if np.sqrt((gap ** 2).sum()) < eps:
+                self.offsets.append(np.array(offset))
+
+
+def find_root(parent, index):
+    '''
+    This function finds the root of an element in a union-find parent array, halving the path on the way
+    :param parent: union-find parent array
+    :param index: the element
+    :return: the root of the element
+    '''
+    while parent[index] != index:
+        parent[index] = parent[parent[index]]
+        index = parent[index]
+    return index
+
+
+def grid_dbscan(data, eps, min_pts):
+    '''
+    This function calculates the clusters based on their density using a grid of cells of side eps/sqrt(d)
+    A cell with at least min_pts points only holds core points, so only the points of the other cells
+    need their neighbors counted. Two cells are in the same cluster when a pair of their core points
+    are closer than eps. The result is the same as the one of dbscan: a border point goes to the
+    first cluster that reaches it, the clusters being numbered in the order of their first core point
+    Only data with at most GRID_MAX_DIMENSIONS dimensions is accepted
+    :param data: input file
+    :param eps: eps value calculated
+    :param min_pts: minimum number of points that should exist in a cluster
+    :return: labels: numpy array with the cluster number of each point, -1 for noise
+             core: boolean numpy array that is True for the core points
+    '''
+    grid = Grid(data, eps)
+    size = len(grid.data)
+    # the points of a dense cell are all within eps of each other
+    core = grid.cell_sizes[grid.cell_of_point] >= min_pts
+    counts = np.zeros(size, dtype=np.int64)
+    sparse = np.flatnonzero(~core)
+    for offset in grid.offsets:
+        for first, second in grid.pairs(sparse, offset):
+            counts += np.bincount(first, minlength=size)
+    core[sparse] = counts[sparse] >= min_pts
+
+    # connect the cells whose core points are closer than eps
+    cores = np.flatnonzero(core)
+    parent = np.arange(len(grid.cell_ids))
+    for offset in grid.offsets:
+        # each pair of cells is seen from both sides, so half of the offsets are enough
+        if tuple(offset) <= tuple(np.zeros_like(offset)):
+            continue
+        for first, second in grid.pairs(cores, offset):
+            to_core = core[second]
+            edges = np.column_stack((grid.cell_of_point[first[to_core]], grid.cell_of_point[second[to_core]]))
+            for cell1, cell2 in np.unique(edges, axis=0):
+                root1 = find_root(parent, cell1)
+                root2 = find_root(parent, cell2)
+                if root1 != root2:
+                    parent[max(root1, root2)] = min(root1, root2)
+
+    # number the clusters in the order of their first core point
+    labels = np.full(size, -1, dtype=np.int64)
+    roots = np.array([find_root(parent, cell) for cell in grid.cell_of_point[cores]], dtype=np.int64)
+    unique_roots, first_core = np.unique(roots, return_index=True)
+    rank = np.empty(len(unique_roots), dtype=np.int64)
+    rank[np.argsort(first_core)] = np.arange(len(unique_roots))
+    labels[cores] = rank[np.searchsorted(unique_roots, roots)]
+
+    # a border point goes to the cluster with the lowest number among its core neighbors
+    border = np.full(size, len(unique_roots), dtype=np.int64)
+    for offset in grid.offsets:
+        for first, second in grid.pairs(sparse, offset):
+            from_core = core[second]
+            np.minimum.at(border, first[from_core], labels[second[from_core]])
+    reached = (~core) & (border < len(unique_roots))
+    labels[reached] = border[reached]
+    return labels, core
+
+
+def connected_components(size, first, second):
+    '''
+    Function that labels the connected components of a graph given as a list of edges
+    The edges are joined with a union-find whose roots are always the smallest index of their set,
+    then every node follows its parents up to the root
+    :param size: number of nodes
+    :param first: numpy array with the first node of each edge
+    :param second: numpy array with the second node of each edge
+    :return: numpy array with the smallest index of the component of each node
+    '''
+    # each edge is kept once, from its smaller to its larger node
+    low = np.minimum(first, second).astype(np.int64)
+    high = np.maximum(first, second).astype(np.int64)
+    keys = np.unique(low[low != high] * size + high[low != high])
+    # a list is faster than an array for the element by element accesses of find_root
+    parent = list(range(size))
+    for node1, node2 in zip((keys // size).tolist(), (keys % size).tolist()):
+        root1 = find_root(parent, node1)
+        root2 = find_root(parent, node2)
+        if root1 != root2:
+            parent[max(root1, root2)] = min(root1, root2)
+    # a parent is never larger than its child, so following the parents ends at the smallest index
+    parent = np.array(parent, dtype=np.int64)
+    while True:
+        grand_parent = parent[parent]
+        if (grand_parent == parent).all():
+            return parent
+        parent = grand_parent
+
+
+def label_clusters(core, first, second, border_core, border_point):
+    '''
+    Function that numbers the clusters from the edges between core points and labels the border points
+    Clusters are numbered in the order of their first core point and a border point goes to the
+    cluster with the lowest number among its core neighbors, like in tree_dbscan
+    :param core: boolean numpy array that is True for the core points
+    :param first: numpy array with the first core point of each edge between core points
+    :param second: numpy array with the second core point of each edge between core points
+    :param border_core: numpy array with the core point of each edge from a core point to a point that is not core
+    :param border_point: numpy array with the point that is not core of each of those edges
+    :return: numpy array with the cluster number of each point, -1 for noise
+    '''
+    size = len(core)
+    roots = connected_components(size, first, second)
+    # the root of a cluster is its first core point, so the roots are in the order of the clusters
+    nodes = np.flatnonzero(core)
+    labels = np.full(size, -1, dtype=np.int64)
+    unique_roots, labels[nodes] = np.unique(roots[nodes], return_inverse=True)
+
+    # a border point goes to the cluster with the lowest number among its core neighbors
+    border = np.full(size, len(unique_roots), dtype=np.int64)
+    np.minimum.at(border, border_point, labels[border_core])
+    reached = (~core) & (border < len(unique_roots))
+    labels[reached] = border[reached]
+    return labels
+
+
+# dataset used by the worker processes of parallel_dbscan, set by init_partition_worker
+worker_memory = None
+worker_data = None
+
+
+def init_partition_worker(name, shape, dtype):
+    '''
+    Function that attaches a worker process to the shared memory block holding the dataset
+    :param name: name of the shared memory block
+    :param shape: shape of the dataset
+    :param dtype: type of the dataset
+    :return: None
+    '''
+    global worker_memory, worker_data
+    worker_memory = shared_memory.SharedMemory(name=name)
+    worker_data = np.ndarray(shape, dtype=dtype, buffer=worker_memory.buf)
+
+
+def partition_dbscan(owned, halo, eps, min_pts):
+    '''
+    Function run by a worker process that clusters the points of one partition
+    The halo holds the points of the other partitions that are within eps of this one, so the
+    neighbors of the owned points, and with them their core status, are exact
+    :param owned: numpy array with the indices of the points of the partition
+    :param halo: numpy array with the indices of the points around the partition
+    :param eps: eps value calculated
+    :param min_pts: minimum number of points that should exist in a cluster
+    :return: owned: the indices of the points of the partition
+             core: boolean numpy array marking the owned core points
+             roots: for each owned point, the smallest owned core point it is connected to through owned core points
+             first, second: pairs of points closer than eps from an owned core point to a point that is
+             not an owned core point, they are joined or labelled once every core point is known
+    '''
+    members = np.concatenate((owned, halo))
+    index = build_index(worker_data[members])
+    # the owned points are the first ones of the partition
+    query_ids, point_ids, _ = index.query_pairs(index.data[:len(owned)], eps)
+    core = np.bincount(query_ids, minlength=len(owned)) >= min_pts
+    from_core = core[query_ids]
+    query_ids = query_ids[from_core]
+    point_ids = point_ids[from_core]
+    inside = np.zeros(len(point_ids), dtype=bool)
+    inside[point_ids < len(owned)] = core[point_ids[point_ids < len(owned)]]
+    # clusters of the owned core points, the other points only link to a core point
+    roots = connected_components(len(owned), query_ids[inside], point_ids[inside])
+    return owned, core, members[roots], members[query_ids[~inside]], members[point_ids[~inside]]
+
+
+def parallel_dbscan(data, eps, min_pts, n_jobs):
+    '''
+    Function that calculates the clusters in n_jobs slabs along the widest dimension at the same time
+    Each slab is clustered by a worker process together with the points within eps of it, then the
+    clusters that have core points closer than eps across two slabs are merged. The labels are the
+    same as the ones of tree_dbscan: clusters are numbered in the order of their first core point
+    and a border point goes to the cluster with the lowest number among its core neighbors
+    :param data: input file
+    :param eps: eps value calculated
+    :param min_pts: minimum number of points that should exist in a cluster
+    :param n_jobs: number of worker processes and of slabs
+    :return: labels: numpy array with the cluster number of each point, -1 for noise
+             core: boolean numpy array that is True for the core points
+    '''
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    size = len(data)
+    # slabs with the same number of points along the widest dimension
+    dim = np.argmax(data.max(axis=0) - data.min(axis=0))
+    coordinate = data[:, dim]
+    cuts = np.quantile(coordinate, np.linspace(0, 1, n_jobs + 1)[1:-1])
+    slab = np.searchsorted(cuts, coordinate, side='right')
+    bounds = np.concatenate(([-np.inf], cuts, [np.inf]))
+    jobs = []
+    for num in range(0, n_jobs):
+        owned = np.flatnonzero(slab == num)
+        if len(owned) == 0:
+            continue
+        near = (coordinate > bounds[num] - eps) & (coordinate < bounds[num + 1] + eps) & (slab != num)
+        jobs.append((owned, np.flatnonzero(near)))
+
+    core = np.zeros(size, dtype=bool)
+    parent = np.arange(size)
+    first = []
+    second = []
+    memory = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    try:
+        shared = np.ndarray(data.shape, dtype=data.dtype, buffer=memory.buf)
+        shared[:] = data
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_partition_worker,
+                                 initargs=(memory.name, data.shape, data.dtype.str)) as pool:
+            results = [pool.submit(partition_dbscan, owned, halo, eps, min_pts) for owned, halo in jobs]
+            for result in results:
+                owned, owned_core, roots, pair_first, pair_second = result.result()
+                core[owned] = owned_core
+                parent[owned] = roots
+                first.append(pair_first)
+                second.append(pair_second)
+        # the array has to be dropped before the buffer can be closed
+        del shared
+    finally:
+        memory.close()
+        memory.unlink()
+    first = np.concatenate(first)
+    second = np.concatenate(second)
+
+    # merge the clusters of the slabs through the pairs of core points across their borders
+    to_core = core[second]
+    nodes = np.flatnonzero(core)
+    labels = label_clusters(core, np.concatenate((nodes, parent[first[to_core]])),
+                            np.concatenate((parent[nodes], parent[second[to_core]])),
+                            first[~to_core], second[~to_core])
+    return labels, core
+
+
+class NeighborGraph:
+    '''
+    Class that stores the neighbors of every point within max_eps as a compressed sparse row graph:
+    the neighbors of point i are indices[indptr[i]:indptr[i + 1]], sorted by their distance which is
+    kept in distances. As the neighbors closer than any eps <= max_eps are the first ones of each row,
+    the graph answers the region queries of every smaller eps without looking at the data again
+    '''
+    def __init__(self, indptr, indices, distances, max_eps):
+        self.indptr = indptr
+        self.indices = indices
+        self.distances = distances
+        self.max_eps = max_eps
+
+    def radius(self, eps):
+        '''
+        Function that keeps, for every point, only the neighbors closer than eps
+        :param eps: the radius of the query, at most max_eps
+        :return: indptr: numpy array, the neighbors of point i are indices[indptr[i]:indptr[i + 1]]
+                 indices: numpy array with the neighbors of all the points
+        '''
+        if eps > self.max_eps:
+            raise ValueError('eps %r is larger than the max_eps %r of the graph' % (eps, self.max_eps))
+        inside = self.distances < eps
+        # the neighbors of a row are sorted by distance, so the ones kept are the first of each row
+        size = len(self.indptr) - 1
+        counts = np.bincount(np.repeat(np.arange(size), np.diff(self.indptr))[inside], minlength=size)
+        indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return indptr, self.indices[inside]
+
+    def save(self, path):
+        '''
+        Function that saves the graph to a .npz file
+        :param path: path of the file
+        :return: None
+        '''
+        np.savez(path, indptr=self.indptr, indices=self.indices, distances=self.distances,
+                 max_eps=np.array(self.max_eps))
+
+
+def build_neighbor_graph(data, max_eps):
+    '''
+    Function that finds the neighbors within max_eps of every point with a spatial index
+    :param data: input file
+    :param max_eps: largest eps that the graph can answer
+    :return: NeighborGraph of the data
+    '''
+    index = build_index(data)
+    query_ids, point_ids, distances = index.query_pairs(index.data, max_eps)
+    # sort by point and then by distance
+    order = np.lexsort((point_ids, distances, query_ids))
+    indptr = np.searchsorted(query_ids[order], np.arange(len(index.data) + 1)).astype(np.int64)
+    return NeighborGraph(indptr, point_ids[order], distances[order], max_eps)
+
+
+def load_neighbor_graph(data, max_eps, directory='dbscan_cache'):
+    '''
+    Function that loads the neighbor graph of the data from the cache directory, the graph is built
+    and saved the first time. The file name is a hash of the data and of max_eps
+    :param data: input file
+    :param max_eps: largest eps that the graph can answer
+    :param directory: directory of the cached graphs
+    :return: NeighborGraph of the data
+    '''
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    key = hashlib.sha1()
+    key.update(np.array(data.shape, dtype='<i8').tobytes())
+    key.update(data.tobytes())
+    key.update(np.array([max_eps], dtype='<f8').tobytes())
+    path = os.path.join(directory, key.hexdigest() + '.npz')
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            return NeighborGraph(cached['indptr'], cached['indices'], cached['distances'], float(cached['max_eps']))
+    graph = build_neighbor_graph(data, max_eps)
+    os.makedirs(directory, exist_ok=True)
+    graph.save(path)
+    return graph
+
+
+def graph_dbscan(graph, eps, min_pts):
+    '''
+    Function that calculates the clusters from a neighbor graph, without the data
+    The labels are the same as the ones of tree_dbscan: clusters are numbered in the order of their
+    first core point and a border point goes to the cluster with the lowest number among its core neighbors
+    :param graph: NeighborGraph built with a max_eps of at least eps
+    :param eps: eps value calculated
+    :param min_pts: minimum number of points that should exist in a cluster
+    :return: labels: numpy array with the cluster number of each point, -1 for noise
+             core: boolean numpy array that is True for the core points
+    '''
+    indptr, indices = graph.radius(eps)
+    size = len(indptr) - 1
+    core = np.diff(indptr) >= min_pts
+    # point of each neighbor pair
+    points = np.repeat(np.arange(size), np.diff(indptr))
+    from_core = core[points]
+    to_core = from_core & core[indices]
+    to_border = from_core & ~core[indices]
+    labels = label_clusters(core, points[to_core], indices[to_core], points[to_border], indices[to_border])
+    return labels, core
+
+
+class Reachability:
+    '''
+    Class that stores the result of optics: the order in which the points were reached, the
+    reachability distance and the core distance of each point, and for each point the core point
+    that reaches it at the smallest distance. The clusters of dbscan for any eps <= max_eps are
+    extracted from it in a linear pass, without the data
+    '''
+    def __init__(self, ordering, reachability, core_distance, nearest_core, border_reachability, max_eps, min_pts):
+        self.ordering = ordering
+        self.reachability = reachability
+        self.core_distance = core_distance
+        self.nearest_core = nearest_core
+        self.border_reachability = border_reachability
+        self.max_eps = max_eps
+        self.min_pts = min_pts
+
+    def extract(self, eps):
+        '''
+        Function that finds the clusters that dbscan gives for an eps
+        Going through the ordering, a core point that cannot be reached within eps from the points
+        before it starts a new cluster and the following ones that can be reached belong to it.
+        A point that is not core goes to the cluster of the core point that reaches it at the smallest
+        distance, so the core points and the noise are the same as the ones of dbscan, a border point
+        that touches several clusters may go to another one of them
+        :param eps: eps value, at most max_eps
+        :return: labels: numpy array with the cluster number of each point, -1 for noise
+                 core: boolean numpy array that is True for the core points
+        '''
+        if eps > self.max_eps:
+            raise ValueError('eps %r is larger than the max_eps %r of the ordering' % (eps, self.max_eps))
+        core = self.core_distance < eps
+        core_in_order = core[self.ordering]
+        starts = core_in_order & (self.reachability[self.ordering] >= eps)
+        labels = np.full(len(core), -1, dtype=np.int64)
+        labels[self.ordering[core_in_order]] = (np.cumsum(starts) - 1)[core_in_order]
+        # number the clusters in the order of their first core point like dbscan
+        cores = np.flatnonzero(core)
+        first_core = np.full(starts.sum(), len(core), dtype=np.int64)
+        np.minimum.at(first_core, labels[cores], cores)
+        rank = np.empty(len(first_core), dtype=np.int64)
+        rank[np.argsort(first_core)] = np.arange(len(first_core))
+        labels[cores] = rank[labels[cores]]
+        # the border points
+        reached = (~core) & (self.border_reachability < eps)
+        labels[reached] = labels[self.nearest_core[reached]]
+        return labels, core
+
+    def save(self, path):
+        '''
+        Function that saves the ordering to a .npz file
+        :param path: path of the file
+        :return: None
+        '''
+        np.savez(path, ordering=self.ordering, reachability=self.reachability, core_distance=self.core_distance,
+                 nearest_core=self.nearest_core, border_reachability=self.border_reachability,
+                 max_eps=np.array(self.max_eps), min_pts=np.array(self.min_pts))
+
+
+def load_reachability(path):
+    '''
+    Function that loads an ordering saved by Reachability.save
+    :param path: path of the file
+    :return: Reachability
+    '''
+    with np.load(path) as saved:
+        return Reachability(saved['ordering'], saved['reachability'], saved['core_distance'], saved['nearest_core'],
+                            saved['border_reachability'], float(saved['max_eps']), int(saved['min_pts']))
+
+
+def optics(data, max_eps, min_pts, cache_directory=None):
+    '''
+    Function that orders the points like OPTICS so that the clusters of every eps <= max_eps can be extracted
+    The core distance of a point is the distance of its min_pts th neighbor, the point included.
+    Starting from a point, the point with the smallest reachability distance among the points
+    reached so far, kept in a heap, is the next one of the ordering, and when it is a core point
+    the reachability of its neighbors is lowered to max(its core distance, their distance)
+    :param data: input file
+    :param max_eps: largest eps that can be extracted
+    :param min_pts: minimum number of points that should exist in a cluster
+    :param cache_directory: if given, the neighbor graph is loaded from and saved to this directory
+    by load_neighbor_graph, otherwise it is only kept in memory
+    :return: Reachability of the data
+    '''
+    if cache_directory is None:
+        graph = build_neighbor_graph(data, max_eps)
+    else:
+        graph = load_neighbor_graph(data, max_eps, cache_directory)
+    size = len(graph.indptr) - 1
+    counts = np.diff(graph.indptr)
+    # the neighbors of each point are sorted by distance
+    core_distance = np.full(size, np.inf)
+    has_core = counts >= min_pts
+    core_distance[has_core] = graph.distances[graph.indptr[:-1][has_core] + min_pts - 1]
+
+    reachability = np.full(size, np.inf)
+    processed = np.zeros(size, dtype=bool)
+    ordering = np.empty(size, dtype=np.int64)
+    position = 0
+    for start in range(0, size):
+        if processed[start]:
+            continue
+        seeds = [(np.inf, start)]
+        while seeds:
+            distance, num = heapq.heappop(seeds)
+            # a point can be in the heap more than once, only its smallest reachability counts
+            if processed[num] or distance > reachability[num]:
+                continue
+            processed[num] = True
+            ordering[position] = num
+            position += 1
+            if not has_core[num]:
+                continue
+            neighbors = graph.indices[graph.indptr[num]:graph.indptr[num + 1]]
+            reach = np.maximum(core_distance[num], graph.distances[graph.indptr[num]:graph.indptr[num + 1]])
+            closer = (~processed[neighbors]) & (reach < reachability[neighbors])
+            reachability[neighbors[closer]] = reach[closer]
+            for other, value in zip(neighbors[closer].tolist(), reach[closer].tolist()):
+                heapq.heappush(seeds, (value, other))
+
+    # for each point, the core point that reaches it at the smallest distance
+    points = np.repeat(np.arange(size), counts)
+    from_core = has_core[points]
+    reach = np.maximum(core_distance[points[from_core]], graph.distances[from_core])
+    targets = graph.indices[from_core]
+    order = np.lexsort((reach, targets))
+    first = np.unique(targets[order], return_index=True)[1]
+    nearest_core = np.arange(size)
+    border_reachability = np.full(size, np.inf)
+    nearest_core[targets[order][first]] = points[from_core][order][first]
+    border_reachability[targets[order][first]] = reach[order][first]
+    return Reachability(ordering, reachability, core_distance, nearest_core, border_reachability, max_eps, min_pts)
+
+
+class IncrementalDBSCAN:
+    '''
+    Class that keeps the DBSCAN clusters of a set of points up to date while points are inserted and deleted
+    The points are hashed into a dictionary of cells of side eps, so the neighbors of a point are in
+    the 3^d cells around it and the index is updated in place. An insertion only looks at the
+    neighborhoods of the new points: points that become core join or merge the clusters of their core
+    neighbors. A deletion re-expands only the clusters that lost a core point, which splits them if needed
+    Points keep the id returned by insert, labels[id] is the cluster of the point, -1 for noise or
+    deleted points. Cluster numbers are not renumbered, so they are not the ones dbscan would give
+    '''
+    def __init__(self, eps, min_pts, capacity=1024):
+        self.eps = eps
+        self.min_pts = min_pts
+        # number of ids given so far
+        self.size = 0
+        self.points = None
+        self.capacity = capacity
+        self.alive = np.zeros(capacity, dtype=bool)
+        # number of points within eps of each point, the point included
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.labels = np.full(capacity, -1, dtype=np.int64)
+        # ids of the points in each cell
+        self.cells = {}
+        # ids of the points in each cluster
+        self.members = {}
+        self.next_label = 0
+        self.offsets = None
+
+    def cell(self, point):
+        '''
+        Function that finds the cell of a point
+        :param point: numpy array of the coordinates of the point
+        :return: tuple of the grid coordinates of the cell
+        '''
+        return tuple(np.floor(point / self.eps).astype(np.int64).tolist())
+
+    def region_query(self, num):
+        '''
+        Function that finds the points closer than eps to a point, the point itself included
+        :param num: id of the point
+        :return: numpy array of the ids of the neighbors
+        '''
+        cell = self.cell(self.points[num])
+        candidates = []
+        for offset in self.offsets:
+            members = self.cells.get(tuple(c + o for c, o in zip(cell, offset)))
+            if members:
+                candidates.extend(members)
+        candidates = np.array(candidates, dtype=np.int64)
+        distance = np.sqrt(((self.points[candidates] - self.points[num]) ** 2).sum(axis=1))
+        return candidates[distance < self.eps]
+
+    def is_core(self, num):
+        '''
+        Function that tells if a point is a core point
+        :param num: id of the point
+        :return: True if there are at least min_pts points within eps of it
+        '''
+        return self.counts[num] >= self.min_pts
+
+    def settled(self, points, pending):
+        '''
+        Function that keeps the core points whose cluster is settled, i.e. that are not waiting to be added
+        :param points: numpy array of ids of points
+        :param pending: set of the ids of the core points that are not in their cluster yet
+        :return: numpy array of the ids of the settled core points among points
+        '''
+        points = points[self.counts[points] >= self.min_pts]
+        return points[[num not in pending for num in points.tolist()]]
+
+    def grow(self, extra):
+        '''
+        Function that makes room for extra more points, doubling the arrays when they are full
+        :param extra: number of points to add
+        :return: None
+        '''
+        if self.size + extra <= self.capacity:
+            return
+        capacity = max(2 * self.capacity, self.size + extra)
+        points = np.zeros((capacity, self.points.shape[1]))
+        points[:self.size] = self.points[:self.size]
+        self.points = points
+        for name, fill in (('alive', False), ('counts', 0), ('labels', -1)):
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def assign(self, num, label):
+        '''
+        Function that moves a point to a cluster
+        :param num: id of the point
+        :param label: cluster of the point, -1 for noise
+        :return: None
+        '''
+        if self.labels[num] >= 0:
+            self.members[self.labels[num]].discard(num)
+        self.labels[num] = label
+        if label >= 0:
+            self.members.setdefault(label, set()).add(num)
+
+    def merge(self, labels):
+        '''
+        Function that merges clusters into the largest one of them
+        :param labels: set of the clusters to merge
+        :return: the cluster they are merged into
+        '''
+        target = max(labels, key=lambda label: len(self.members[label]))
+        for label in labels:
+            if label == target:
+                continue
+            members = self.members.pop(label)
+            self.labels[list(members)] = target
+            self.members[target].update(members)
+        return target
+
+    def insert(self, points):
+        '''
+        Function that adds a batch of points and updates the clusters around them
+        :param points: m x d numpy array of the new points
+        :return: numpy array of the ids of the new points
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)
+        if len(points) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.points is None:
+            self.points = np.zeros((self.capacity, points.shape[1]))
+            self.offsets = list(itertools.product((-1, 0, 1), repeat=points.shape[1]))
+        self.grow(len(points))
+        ids = np.arange(self.size, self.size + len(points))
+        self.points[ids] = points
+        self.alive[ids] = True
+        self.size += len(points)
+        for num in ids:
+            self.cells.setdefault(self.cell(self.points[num]), set()).add(num)
+
+        # the new points count each other, the old points only count the new ones
+        neighbors = dict((num, self.region_query(num)) for num in ids)
+        old_neighbors = []
+        for num in ids:
+            self.counts[num] = len(neighbors[num])
+            old_neighbors.append(neighbors[num][neighbors[num] < ids[0]])
+        old_neighbors = np.concatenate(old_neighbors)
+        touched = np.unique(old_neighbors)
+        before = self.counts[touched].copy()
+        np.add.at(self.counts, old_neighbors, 1)
+        promoted = touched[(before < self.min_pts) & (self.counts[touched] >= self.min_pts)]
+
+        # core points of the batch whose clusters are not settled yet
+        candidates = np.concatenate((promoted, ids))
+        pending = set(candidates[self.counts[candidates] >= self.min_pts].tolist())
+        for num in candidates:
+            if not self.is_core(num):
+                continue
+            if num not in neighbors:
+                neighbors[num] = self.region_query(num)
+            around = neighbors[num]
+            # the clusters of the core neighbors are joined through this point
+            labels = set(self.labels[self.settled(around, pending)].tolist())
+            if labels:
+                label = self.merge(labels)
+            else:
+                label = self.next_label
+                self.next_label += 1
+            self.assign(num, label)
+            pending.discard(num)
+            # its neighbors that are not in a cluster become border points
+            for other in around[self.labels[around] == -1]:
+                self.assign(other, label)
+        # the new points that are not core go to the cluster of a core neighbor
+        for num in ids[self.labels[ids] == -1]:
+            around = self.settled(neighbors[num], pending)
+            if len(around):
+                self.assign(num, self.labels[around].min())
+        return ids
+
+    def delete(self, ids):
+        '''
+        Function that removes a batch of points and updates the clusters around them
+        :param ids: ids of the points to remove
+        :return: None
+        '''
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        ids = ids[self.alive[ids]]
+        neighbors = []
+        for num in ids:
+            neighbors.append(self.region_query(num))
+        for num in ids:
+            self.cells[self.cell(self.points[num])].discard(num)
+            self.alive[num] = False
+        neighbors = np.concatenate(neighbors) if neighbors else np.zeros(0, dtype=np.int64)
+        neighbors = neighbors[self.alive[neighbors]]
+        touched = np.unique(neighbors)
+        before = self.counts[touched].copy()
+        np.subtract.at(self.counts, neighbors, 1)
+        demoted = touched[(before >= self.min_pts) & (self.counts[touched] < self.min_pts)]
+
+        # clusters that lost a core point may fall apart
+        lost = ids[self.counts[ids] >= self.min_pts]
+        affected = set(self.labels[np.concatenate((lost, demoted))].tolist()) - {-1}
+        for num in ids:
+            self.assign(num, -1)
+            self.counts[num] = 0
+        for label in affected:
+            self.expand(label)
+
+    def expand(self, label):
+        '''
+        Function that finds the clusters again among the points of a cluster, after some of its core points were removed
+        The first part found keeps the label of the cluster, the other parts get new labels
+        :param label: cluster to re-expand
+        :return: None
+        '''
+        members = self.members.pop(label)
+        for num in members:
+            self.labels[num] = -1
+        new_label = label
+        for start in members:
+            if self.labels[start] != -1 or not self.is_core(start):
+                continue
+            self.assign(start, new_label)
+            frontier = deque([start])
+            while frontier:
+                num = frontier.popleft()
+                for other in self.region_query(num):
+                    if self.labels[other] != -1:
+                        continue
+                    self.assign(other, new_label)
+                    if self.is_core(other):
+                        frontier.append(other)
+            new_label = self.next_label
+            self.next_label += 1
+        # the border points that are left go to the cluster of another core neighbor if they have one
+        for num in members:
+            if self.labels[num] != -1:
+                continue
+            around = self.region_query(num)
+            around = around[self.counts[around] >= self.min_pts]
+            if len(around):
+                self.assign(num, self.labels[around].min())
 
 
 def main():
@@ -17,160 +974,171 @@ def main():
         for col in range(0, len(input_file[1])):
             input_file[row][col] = float(input_file[row][col])
 
-    get_eps(input_file)
-    dbscan(input_file)
+    # the eps at the knee of the curves is only shown, the clusters use the eps of dbscan
+    print('Suggested eps: ', get_eps(input_file, min_pts=5))
+    # the clusters are formed on every core
+    dbscan(input_file, n_jobs=os.cpu_count())
+
 
+def k_nearest_distances(data, k_max=10, chunk_size=1024):
+    '''
+    Function that finds the distances from every point to its k_max nearest neighbors in one pass
+    The distances are calculated a block of chunk_size rows at a time and only the k_max + 1
+    smallest of each row are kept with np.argpartition, so the n x n matrix is never stored or sorted
+    :param data: input file
+    :param k_max: number of neighbors
+    :param chunk_size: number of rows whose distances are calculated at once
+    :return: n x k_max numpy array, column k - 1 holds the distance of the kth neighbor of each point
+    '''
+    data = np.asarray(data, dtype=np.float64)
+    # the point itself is at distance 0, so keep one more than k_max and drop the first column
+    kept = min(k_max + 1, len(data))
+    squared_norms = (data ** 2).sum(axis=1)
+    distances = np.empty((len(data), kept - 1))
+    for first in range(0, len(data), chunk_size):
+        block = data[first:first + chunk_size]
+        # squared distances of the block to every point
+        squared = squared_norms[first:first + chunk_size, None] - 2 * block @ data.T + squared_norms[None, :]
+        np.maximum(squared, 0, out=squared)
+        # the point itself is exactly at distance 0
+        squared[np.arange(len(block)), np.arange(first, first + len(block))] = 0
+        if kept < len(data):
+            nearest = np.argpartition(squared, kept - 1, axis=1)[:, :kept]
+            squared = np.take_along_axis(squared, nearest, axis=1)
+        squared.sort(axis=1)
+        distances[first:first + chunk_size] = np.sqrt(squared[:, 1:])
+    return distances
 
-def get_eps(data):
+
+def find_knee(curve):
+    '''
+    Function that finds the knee of a sorted k-distance curve, i.e. the point that is the farthest
+    from the straight line joining the first and the last point of the curve
+    :param curve: sorted numpy array of distances
+    :return: the distance at the knee
     '''
-    This function plots the 'n' th neighbor of each point in the data where 0 < n < 11
+    # scaling both axes to [0, 1] so the knee does not depend on the units
+    x = np.linspace(0, 1, len(curve))
+    spread = curve[-1] - curve[0]
+    y = (curve - curve[0]) / spread if spread > 0 else np.zeros(len(curve))
+    # the curve is convex, so the farthest point below the line y = x maximizes x - y
+    return curve[np.argmax(x - y)]
+
+
+def get_eps(data, k_max=10, min_pts=None):
+    '''
+    This function plots the 'n' th neighbor of each point in the data where 0 < n < k_max + 1
     The eps value can be calculated from the graph
     :param data: input file
-    :return: None
+    :param k_max: largest neighbor to plot
+    :param min_pts: if given, the eps at the knee of the curve of the (min_pts - 1)th neighbor is suggested
+    :return: the suggested eps, None if min_pts is not given
     '''
-    # k value ranges from 1 to 10
-    for k in range(1, 11):
-        # list containing the distance of kth neighbor
-        eps = []
-        # for every row in data
-        for row2 in data:
-            # list containing the distances of all the points
-            neighbors = []
-            # converting to numpy array
-            list2 = np.array(row2)
-            # for every row in data
-            for row1 in data:
-                # converting to numpy array
-                list1 = np.array(row1)
-                # calculating the euclidean distance
-                euclidean_distance = np.linalg.norm(list1 - list2)
-                # adding the distance to the list
-                neighbors.append(euclidean_distance)
-            # sorting the distances
-            neighbors.sort()
-            # adding the distance of kth neighbor to the list
-            eps.append(neighbors[k])
-        # sorting the distances
-        eps.sort()
-        # plotting the distances
-        pplot.plot(range(0, len(data)), eps)
+    # distances to the k_max nearest neighbors of all the points at once
+    distances = k_nearest_distances(data, k_max)
+    # sorting the distances of each neighbor
+    curves = np.sort(distances, axis=0)
+    # plotting the distances
+    pplot.plot(range(0, len(curves)), curves)
     # labelling the graph
     pplot.xlabel('Data points')
     pplot.ylabel('Distance')
-    pplot.title('Data points VS Distance of \'k\'th(1-10) neighbor')
-    pplot.legend(range(1, 11))
+    pplot.title('Data points VS Distance of \'k\'th(1-%d) neighbor' % curves.shape[1])
+    legend = list(range(1, curves.shape[1] + 1))
+    eps = None
+    if min_pts is not None:
+        # a point is core when its (min_pts - 1)th neighbor is within eps
+        k = min(max(min_pts - 1, 1), curves.shape[1])
+        eps = find_knee(curves[:, k - 1])
+        pplot.axhline(eps, color='black', linestyle='--')
+        legend.append('suggested eps %.3f' % eps)
+    pplot.legend(legend)
     pplot.show()
+    return eps
 
 
-def get_neighbors(row, data, eps):
+def get_neighbors(num, indptr, indices):
     '''
-    This function calculated the neighboring points i.e. the points within the eps distance of the point
-    :param row: a row or a point from the data whose neighbors are to be found out
-    :param data: the input file
-    :param eps: the eps value calculated from the above function
-    :return: a list of indices of the neighboring points
+    This function gives the neighboring points i.e. the points within the eps distance of the point
+    :param num: the index of the point whose neighbors are to be found out
+    :param indptr: the neighbors of point i are indices[indptr[i]:indptr[i + 1]]
+    :param indices: the neighbors of all the points, found by SpatialIndex.query_neighborhoods
+    :return: numpy array of the indices of the neighboring points
     '''
-    # list of neighbors within the eps range
-    neighbors = []
-    # renaming for convenience
-    list2 = row
-    # convert the list to a numpy array
-    list2 = np.array(list2)
-
-    # for each index in data
-    for num in range(0, len(data)):
-        # renaming
-        list1 = data[num]
-        # convert the list to a numpy array
-        list1 = np.array(list1)
-        # calculate the euclidean distance using numpy function
-        euclidean_distance = np.linalg.norm(list1 - list2)
-        # if distance is less than eps value
-        if euclidean_distance < eps:
-            # add the index of that point to the neighbors list
-            neighbors.append(num)
-    # return the list
-    return neighbors
+    return indices[indptr[num]:indptr[num + 1]]
 
 
-def add_neighboring_points(num, neighbors, new_cluster_list, eps, min_pts, clusters, visited, data):
+def add_neighboring_points(num, neighbors, cluster, labels, visited, core, min_pts, indptr, indices):
     '''
-
+    Function that grows a new cluster from the core point num
+    The points still to be looked at are kept in a queue, a point is only added to the queue
+    if it has not been expanded yet or is not in a cluster yet, so each point is expanded at most once
     :param num: the index of the data point
     :param neighbors: the neighbors of num
-    :param new_cluster_list: new list to add elements to the new cluster
-    :param eps: eps value calculated
+    :param cluster: label of the new cluster
+    :param labels: numpy array with the cluster of each point, -1 if it is not in a cluster
+    :param visited: boolean numpy array marking the points whose neighbors have been looked up
+    :param core: boolean numpy array marking the core points
     :param min_pts: minimum number of points that should exist in a cluster
-    :param clusters: 2D list of clusters
-    :param visited: list containing the indices of the visited data points
-    :param data: input file
+    :param indptr: the neighbors of point i are indices[indptr[i]:indptr[i + 1]]
+    :param indices: the neighbors of all the points
     :return: None
     '''
-    # add the index to new cluster
-    new_cluster_list.append(num)
-    # for each neighboring point
-    for num1 in neighbors:
-        # if not present in visited list
-        if num1 not in visited:
-            # add it to the visited list
-            visited.append(num1)
+    # add the index to the new cluster
+    labels[num] = cluster
+    # queue of the points reached by the cluster
+    frontier = deque(neighbors)
+    while frontier:
+        num1 = frontier.popleft()
+        # a point that is already part of a cluster stays there
+        if labels[num1] == -1:
+            labels[num1] = cluster
+        # if its neighbors have not been looked up yet
+        if not visited[num1]:
+            visited[num1] = True
             # get its neighbors
-            non = get_neighbors(data[num1], data, eps)
-            # if length is greater than or equal to min_pts
+            non = get_neighbors(num1, indptr, indices)
+            # if length is greater than or equal to min_pts the cluster grows through it
             if len(non) >= min_pts:
-                # for each element in neighbors
-                for neb in non:
-                    # if not in neighbors list
-                    if neb not in neighbors:
-                        # add it to the neighbors list
-                        neighbors.append(neb)
-
-        # initialize a flag
-        flag = False
-        # for each cluster in the clusters list
-        for cl in clusters:
-            # if the neighbor is in the cluster
-            if num1 in cl:
-                # mark the flag as True i.e. it is already a part of the cluster
-                flag = True
-                # so no need to add the point to any cluster
-                break
-        # if point not in any of the clusters
-        if flag == False:
-            # add that point to the cluster list
-            new_cluster_list.append(num1)
-
-    # append the new cluster list to the 2D clusters list
-    clusters.append(new_cluster_list)
-
-
-def calculate_center_of_mass(clusters, data):
-    '''
-    This function calculated the center of mass of each cluster
-    :param clusters: 2D list of clusters
+                core[num1] = True
+                frontier.extend(non[(~visited[non]) | (labels[non] == -1)])
+
+
+def tree_dbscan(data, eps, min_pts):
+    '''
+    Function that finds the clusters with region queries on a spatial index
+    The neighborhoods of all the points are found first with batched queries, then the clusters
+    are expanded from them
     :param data: input file
-    :return: A list containing all the center of masses
+    :param eps: epsilon value
+    :param min_pts: minimum number of points within eps of a point for it to be a core point
+    :return: labels: numpy array with the cluster of each point, -1 for noise
+             core: boolean numpy array marking the core points
     '''
-    # a 2D list that will contain center of mass for each cluster
-    center_of_mass_list = []
-    # for each cluster in cluster list
-    for cl in clusters:
-        # create a new new list to store all the data points corresponding to the indices
-        center_of_mass = []
-        # for each element in the cluster
-        for element in cl:
-            # add all the elements in that cluster to the list
-            center_of_mass.append(data[element])
-        # converting to a numpy array
-        com_array = np.array(center_of_mass)
-        # calculating the mean
-        com = np.mean(com_array, axis=0)
-        # rounding off to 2 decimal places
-        com = np.round(com, 2).tolist()
-        # adding the center of mass to the center of mass list
-        center_of_mass_list.append(com)
-    # returning the list
-    return center_of_mass_list
+    # spatial index built once for all the region queries
+    index = build_index(data)
+    indptr, indices = index.query_neighborhoods(eps)
+    # cluster of each point, -1 until it is added to a cluster
+    labels = np.full(len(index.data), -1, dtype=np.int64)
+    # points whose neighbors have been looked up
+    visited = np.zeros(len(index.data), dtype=bool)
+    core = np.zeros(len(index.data), dtype=bool)
+    # label of the next cluster
+    cluster = 0
+    # for each index in the data
+    for num in range(0, len(index.data)):
+        # if the index is not visited yet
+        if not visited[num]:
+            visited[num] = True
+            # get the neighbors of that point
+            neighbors = get_neighbors(num, indptr, indices)
+            # if there are enough neighbors start a new cluster, otherwise it stays noise
+            # unless a later cluster reaches it
+            if len(neighbors) >= min_pts:
+                core[num] = True
+                add_neighboring_points(num, neighbors, cluster, labels, visited, core, min_pts, indptr, indices)
+                cluster += 1
+    return labels, core
 
 
 def plot_clusters(clusters, data):
@@ -200,50 +1168,43 @@ def plot_clusters(clusters, data):
     pplot.show()
 
 
-def dbscan(data):
+def dbscan(data, eps=0.61, min_pts=5, backend='tree', n_jobs=1, max_eps=None):
     '''
     This function calculated the clusters based on their density
     :param data: input file
-    :return: None
+    :param eps: epsilon value
+    :param min_pts: minimum number of points that should exist in a cluster or else consider noise
+    :param backend: 'tree' expands the clusters with region queries on a spatial index,
+    'grid' uses grid_dbscan which is faster for low-dimensional data, it raises a ValueError when the
+    data has more than GRID_MAX_DIMENSIONS dimensions
+    'graph' answers the region queries from the neighbor graph cached on disk by load_neighbor_graph
+    :param n_jobs: with more than one job the 'tree' backend clusters slabs of the data in parallel,
+    the other backends only run with one job
+    :param max_eps: radius of the cached neighbor graph, eps if not given, so that runs with any
+    smaller eps and any min_pts reuse the same graph
+    :return: numpy array with the cluster of each point, -1 for noise
     '''
+    if backend not in ('tree', 'grid', 'graph'):
+        raise ValueError('Unknown backend: ' + str(backend))
+    if n_jobs > 1 and backend != 'tree':
+        raise ValueError('Only the tree backend runs with more than one job, not ' + str(backend))
 
-    # initializing the varibles
-    # epsilon value
-    eps = 0.61
-    # minimum number of points that should exist in a cluster or else consider noise
-    min_pts = 5
+    if backend == 'grid':
+        labels, core = grid_dbscan(data, eps, min_pts)
+    elif backend == 'graph':
+        graph = load_neighbor_graph(data, eps if max_eps is None else max_eps)
+        labels, core = graph_dbscan(graph, eps, min_pts)
+    elif n_jobs > 1:
+        labels, core = parallel_dbscan(data, eps, min_pts, n_jobs)
+    else:
+        labels, core = tree_dbscan(data, eps, min_pts)
     # 2D list that will contain the list of points in each cluster
-    clusters = []
-    # list that will contain the indices of the visited data points
-    visited = []
+    clusters = [np.flatnonzero(labels == num).tolist() for num in range(0, labels.max() + 1)]
     # list that will contain the indices of the points that are considered as noise
-    noise = []
-    # for each index in the data
-    for num in range(0, len(data)):
-        # if the index is not in visited list
-        if num not in visited:
-            # add the index to the visited list
-            visited.append(num)
-            # get the neighbors of that point
-            neighbors = get_neighbors(data[num], data, eps)
-            # if the length of neighbors list is less than min_pts
-            if len(neighbors) < min_pts:
-                # add the index in the noise list
-                noise.append(num)
-            else:
-                # create a new cluster list
-                new_cluster_list = []
-                # add the neighboring points of each cluster element
-                add_neighboring_points(num, neighbors, new_cluster_list, eps, min_pts, clusters, visited, data)
-
-    # calculate the center of mass of all the clusters
-    center_of_mass_list = calculate_center_of_mass(clusters, data)
-    # add columns cluster_no, number of elements and center of mass in a dataframe
-    df = pd.DataFrame(columns=['cluster no', 'no of elements', 'center of mass'])
-    # for all clusters
-    for num in range(0, len(clusters)):
-        # add the data to the dataframe
-        df.loc[num] = [num, len(clusters[num]), center_of_mass_list[num]]
+    noise = np.flatnonzero(labels == -1).tolist()
+
+    # dataframe with the number of elements, center of mass, sse, radius and bounding box of all the clusters
+    df = summary_table(cluster_statistics(np.asarray(data, dtype=np.float64), labels, len(clusters)))
 
     # sort the dataframe by number of elements in ascending order
     df = df.sort_values(by='no of elements', ascending=True)
@@ -253,6 +1214,8 @@ def dbscan(data):
 
     # 3D plot of the clusters
     plot_clusters(clusters, data)
+    return labels
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -1,201 +1,605 @@
 import csv
 import numpy as np
-import random
-import copy
+import os
+import time
 import matplotlib.pyplot as plt
-import math
+import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
 from mpl_toolkits.mplot3d import axes3d
+from cluster_statistics import cluster_statistics, cluster_sums, squared_errors, summary_table
+from grid_hash import CellIndex
 
 
-class Clusters:
+class DistanceBounds:
     '''
-    Class that stores the properties of a cluster such as
-    cluster_id, the members (guest_id) in that cluster and center of mass
-    or the average of each column elements in that cluster
+    Class that stores the distance bounds of each point that are carried from one iteration to the next
+    so that the distances which cannot change the nearest cluster are not calculated
     '''
-    def __init__(self, cluster_id, members, center_of_mass):
-        self.cluster_id = cluster_id
-        self.members = members
-        self.center_of_mass = center_of_mass
+    def __init__(self, method):
+        # 'hamerly' keeps one lower bound per point, 'elkan' keeps one lower bound per point and cluster
+        self.method = method
+        # nearest cluster of each point
+        self.labels = None
+        # upper bound on the distance from each point to its nearest cluster
+        self.upper = None
+        # lower bound(s) on the distance from each point to the other clusters
+        self.lower = None
+        # centers of mass used in the previous iteration
+        self.centers = None
+        # number of point to center distances calculated and skipped so far
+        self.computed = 0
+        self.skipped = 0
 
 class K_means:
     '''
     Class that contains the entire process of kmeans clustering
     Each task is carried out by an individual function
     '''
+    def __init__(self, chunk_size=4096, batch_size=None, passes=3, algorithm='lloyd', init='k-means++', seed=None,
+                 restarts=1, n_jobs=1, tol=1e-4, max_iter=300, verbose=False, block_size=65536, n_threads=1,
+                 sample_size=2000, selection='silhouette'):
+        '''
+        :param chunk_size: number of rows for which the distances to the centers are calculated at once
+        :param algorithm: 'lloyd' calculates every distance in every iteration, 'hamerly' and 'elkan' use
+        distance bounds to skip the distances that cannot change the assignment, 'auto' uses hamerly
+        for k up to 20 and elkan above that
+        :param batch_size: if given, main streams the csv file in batches of this many rows
+        and the clusters are formed with mini-batch kmeans instead of loading the whole file
+        :param passes: number of passes over the file made by mini-batch kmeans
+        :param block_size: number of rows read at once by each pass of lloyd over the data,
+        which matters when the data is a memory-mapped file
+        :param n_threads: number of threads that process the blocks of a pass
+        :param sample_size: number of points sampled to estimate the silhouette score and to choose the
+        initial centers of mini-batch kmeans
+        :param selection: score used by sweep to choose k, 'silhouette', 'calinski_harabasz' or 'davies_bouldin'
+        '''
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.passes = passes
+        if algorithm not in ('lloyd', 'hamerly', 'elkan', 'auto'):
+            raise ValueError('Unknown algorithm: ' + str(algorithm))
+        self.algorithm = algorithm
+        if init not in ('random', 'k-means++', 'k-means||'):
+            raise ValueError('Unknown init: ' + str(init))
+        self.init = init
+        self.seed = seed
+        self.random_state = np.random.default_rng(seed)
+        self.restarts = restarts
+        self.n_jobs = n_jobs
+        self.tol = tol
+        if max_iter < 1:
+            raise ValueError('max_iter must be at least 1: ' + str(max_iter))
+        self.max_iter = max_iter
+        self.verbose = verbose
+        # one entry per iteration with its shift, sse and time
+        self.history = []
+        self.block_size = block_size
+        self.n_threads = n_threads
+        self.sample_size = sample_size
+        if selection not in ('silhouette', 'calinski_harabasz', 'davies_bouldin'):
+            raise ValueError('Unknown selection: ' + str(selection))
+        self.selection = selection
+        # labels and centers of mass of the last call to form_clusters
+        self.labels = None
+        self.centers = None
+        # scores, labels and centers of mass of the lowest sse run of each k and the k chosen by the last sweep
+        self.scores = {}
+        self.sweep_labels = {}
+        self.sweep_centers = {}
+        self.best_k = None
+
     def initialize_clusters(self, data, k):
         '''
-        Function that forms initial clusters from the given data
+        Function that chooses the initial center of mass of each cluster from the given data
         :param data: the actual dataset that is given as an input
-        :return: a dictionary in which the keys are 'cluster_ids' and values are the objects of
-        class 'Clusters'
-        '''
-        # generates random k values from dataset
-        random_points = random.sample(range(len(data)), k)
-        data = [data[row] for row in random_points]
-
-        # initialize an empty dictionary
-        clusters_dict = {}
-        cluster_id = 0
-        # add information to the Clusters object and add it to the dictionary
-        for row in data:
-            #print(row)
-            members = []
-            # add members
-            members.append(row)
-            # add center of mass which is entire record except for guest_id
-            center_of_mass = row
-            # create a new object
-            cl = Clusters(cluster_id, members, center_of_mass)
-            # add the object to the dictionary
-            clusters_dict[cluster_id] = cl
-            # increment value of cluster_id
-            cluster_id += 1
-        # return the dictionary with k randomly chosen centroids
-        return clusters_dict
-
-    def adding_points_to_clusters(self, clusters_dict, data):
-        '''
-        Function that adds each data point to the clusters
-        :param clusters_dict: the dictionary containing the objects of type 'Clusters'
-        :return: the ids of 2 clusters between which the distance is minimum
-        '''
-        # for each row in the data
-        for row in data:
-            # initialize variables
-            min_distance_cluster_id = -1
-            min_euclidean_distance = 9999999
-            # get the center of mass of that cluster into a list to calculate the distance
-            list2 = row
-            # convert the list to a numpy array
-            list2 = np.array(list2)
-            # iterate through each key in the dictionary
-            for id in clusters_dict.keys():
-                # get the center of mass of that cluster into a list to calculate the distance
-                list1 = clusters_dict[id].center_of_mass
-                # convert the list to a numpy array
-                list1 = np.array(list1)
-                # calculate the euclidean distance using numpy function
-                euclidean_distance = np.linalg.norm(list1 - list2)
-                # keep track of the minimum distance and the cluster ids
-                if euclidean_distance < min_euclidean_distance:
-                    min_euclidean_distance = euclidean_distance
-                    min_distance_cluster_id = id
-
-            # assigning the point to the nearest centroid or cluster
-            clusters_dict[min_distance_cluster_id].members.append(row)
-            # if len(clusters_dict)==6:
-            #     for id in clusters_dict.keys():
-            #         print('Cluster ', id, ': ', len(clusters_dict[id].members))
-            #print('Row ', row, ' >>> ', min_distance_cluster_id)
-        # return the dictionary
-        return clusters_dict
-
-    def calculate_center_of_mass(self, clusters_dict):
-        '''
-        Function that calculates the center of mass for a given set of records
-        It uses the weighted average technique to calculate the new average or the
-        new center of mass
-        :param members_count1: used as a weight which will be multiplied to the center of mass of the first cluster
-        :param current_center_of_mass1: center of mass of the first cluster
-        :param members_count2: used as a weight which will be multiplied to the center of mass of the second cluster
-        :param current_center_of_mass2: center of mass of the second cluster
-        :return: return the centre of mass for a single cluster formed out of the two clusters
-        provided as input
-        '''
-
-        # add the center of mass of first cluster, once for each element in the cluster (weighted average)
-        for id in clusters_dict.keys():
-            #2D list that will be converted to 2D numpy array
-            avg = []
-            # add each element in the cluster to a 2D list
-            for member in clusters_dict[id].members:
-                avg.append(member)
-
-            # convert 2D list to 2D numpy array to calculate the mean
-            avg = np.array(avg)
-
-            # return the center of mass for the new cluster
-            com = np.mean(avg, axis=0).tolist()
-            com = np.round(com, 0)
-            #print('COM for cluster ', id, ' is ', com)
-            clusters_dict[id].center_of_mass = com
-
-        return clusters_dict
-
-    def change_in_centroid_position(self, cluster_dict, new_cluster_dict):
-        '''
-        this method checks for the change in old and new center of mass
-        :param cluster_dict: input data
-        :param new_cluster_dict: new calculated center of mass
-        :return: whether both of the above are same
-        '''
-        if len(new_cluster_dict) == 0 or len(cluster_dict) == 0:
-            return True
-
-        # compare each element from both the dictionaries
-        for id in new_cluster_dict.keys():
-            for index in range(0, len(cluster_dict[id].center_of_mass)):
-                if cluster_dict[id].center_of_mass[index] != new_cluster_dict[id].center_of_mass[index]:
-                    return True
-        return False
-
-    def print_dict(self, clusters_dict):
-        '''
-        function to print the dictionary
-        :param clusters_dict: dictionary containing clusters
+        :param k: number of clusters
+        :return: k x d numpy array in which row i is the center of mass of cluster i
+        '''
+        # chooses k values from dataset
+        if self.init == 'k-means++':
+            random_points = self.kmeans_plus_plus(data, k)
+        elif self.init == 'k-means||':
+            random_points = self.kmeans_parallel(data, k)
+        else:
+            random_points = self.random_state.choice(len(data), k, replace=False)
+        # return the k chosen centroids
+        return np.array(data[random_points], dtype=np.float64)
+
+    def squared_distances_to(self, data, center):
+        '''
+        Function that calculates the squared euclidean distance from every point to one center
+        :param data: n x d numpy array of the data points, read one block at a time
+        :param center: numpy array of length d
+        :return: numpy array of length n
+        '''
+        center = np.asarray(center, dtype=np.float64)
+        distances = np.empty(len(data))
+        for start in range(0, len(data), self.block_size):
+            block = np.asarray(data[start:start + self.block_size], dtype=np.float64)
+            distances[start:start + len(block)] = ((block - center) ** 2).sum(axis=1)
+        return distances
+
+    def kmeans_plus_plus(self, data, k, weights=None):
+        '''
+        Function that chooses the initial centers with k-means++
+        Each new center is a point chosen with probability proportional to its squared distance
+        to the closest center chosen so far
+        :param data: n x d numpy array of the data points
+        :param k: number of centers
+        :param weights: optional weight of each point
+        :return: numpy array with the indices of the chosen points
+        '''
+        if weights is None:
+            weights = np.ones(len(data))
+        chosen = [int(self.random_state.choice(len(data), p=weights / weights.sum()))]
+        closest = self.squared_distances_to(data, data[chosen[0]])
+        for num in range(1, k):
+            potential = weights * closest
+            if potential.sum() == 0:
+                # every point is already a center, pick any point that was not chosen
+                potential = np.ones(len(data))
+                potential[chosen] = 0
+            index = int(self.random_state.choice(len(data), p=potential / potential.sum()))
+            chosen.append(index)
+            closest = np.minimum(closest, self.squared_distances_to(data, data[index]))
+        return np.array(chosen)
+
+    def kmeans_parallel(self, data, k, rounds=5):
+        '''
+        Function that chooses the initial centers with k-means||
+        In each round every point is sampled independently with probability proportional to its
+        squared distance to the candidates, about 2k points per round. The candidates are then
+        weighted by the number of points closest to them and reduced to k centers with k-means++
+        :param data: n x d numpy array of the data points
+        :param k: number of centers
+        :param rounds: number of sampling rounds
+        :return: numpy array with the indices of the chosen points
+        '''
+        oversampling = 2 * k
+        candidates = [int(self.random_state.integers(len(data)))]
+        closest = self.squared_distances_to(data, data[candidates[0]])
+        for num in range(0, rounds):
+            cost = closest.sum()
+            if cost == 0:
+                break
+            sampled = np.flatnonzero(self.random_state.random(len(data)) < oversampling * closest / cost)
+            candidates.extend(sampled.tolist())
+            if len(sampled) == 0:
+                continue
+            # one pass over the data for all the points sampled in this round
+            sampled_points = np.asarray(data[sampled], dtype=np.float64)
+            for start in range(0, len(data), self.block_size):
+                block = data[start:start + self.block_size]
+                nearest = self.point_center_distances(block, sampled_points).min(axis=1) ** 2
+                closest[start:start + len(block)] = np.minimum(closest[start:start + len(block)], nearest)
+        candidates = np.unique(candidates)
+        if len(candidates) <= k:
+            # not enough candidates were sampled, add random points
+            others = np.setdiff1d(np.arange(len(data)), candidates)
+            extra = self.random_state.choice(others, k - len(candidates), replace=False)
+            return np.concatenate((candidates, extra))
+        # weight each candidate by the number of points closest to it
+        labels, sse = self.adding_points_to_clusters(data[candidates], data)
+        weights = np.bincount(labels, minlength=len(candidates)).astype(np.float64)
+        return candidates[self.kmeans_plus_plus(data[candidates], k, weights)]
+
+    def adding_points_to_clusters(self, centers, data):
+        '''
+        Function that assigns each data point to the nearest cluster
+        The distances are calculated for a block of rows at a time as ||x||^2 - 2x.c + ||c||^2,
+        so each block is a single matrix product and the memory used is bounded by chunk_size x k.
+        The squared distance to the nearest center is summed on the way, which gives the sse
+        :param centers: k x d numpy array with the center of mass of each cluster
+        :param data: n x d numpy array of the data points
+        :return: labels: int32 numpy array with the id of the nearest cluster of each data point
+                 sse: sum of squared distances from each point to its nearest center
+        '''
+        centers = np.asarray(centers, dtype=np.float64)
+        center_norms = (centers ** 2).sum(axis=1)
+        labels = np.empty(len(data), dtype=np.int32)
+        sse = 0
+        for start in range(0, len(data), self.chunk_size):
+            chunk = np.asarray(data[start:start + self.chunk_size], dtype=np.float64)
+            # ||x||^2 is the same for every center so it is only added to the minimum
+            distances = center_norms - 2 * (chunk @ centers.T)
+            nearest = np.argmin(distances, axis=1)
+            labels[start:start + len(chunk)] = nearest
+            minimum = distances[np.arange(len(chunk)), nearest] + (chunk ** 2).sum(axis=1)
+            # rounding can make the squared distance slightly negative
+            sse += np.maximum(minimum, 0).sum()
+        return labels, sse
+
+    def point_center_distances(self, points, centers):
+        '''
+        Function that calculates the euclidean distance from every point to every center
+        :param points: m x d numpy array of points
+        :param centers: k x d numpy array of centers
+        :return: m x k numpy array of distances
+        '''
+        distances = np.empty((len(points), len(centers)))
+        center_norms = (centers ** 2).sum(axis=1)
+        for start in range(0, len(points), self.chunk_size):
+            chunk = np.asarray(points[start:start + self.chunk_size], dtype=np.float64)
+            squared = (chunk ** 2).sum(axis=1)[:, None] - 2 * (chunk @ centers.T) + center_norms
+            # rounding can make the squared distance slightly negative
+            distances[start:start + len(chunk)] = np.sqrt(np.maximum(squared, 0))
+        return distances
+
+    def center_distances(self, centers):
+        '''
+        Function that calculates the distance between every pair of centers
+        :param centers: k x d numpy array of centers
+        :return: k x k numpy array of distances with inf on the diagonal
+        '''
+        distances = np.sqrt(((centers[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2))
+        np.fill_diagonal(distances, np.inf)
+        return distances
+
+    def bounded_assignment(self, centers, data, bounds):
+        '''
+        Function that assigns each data point to the nearest cluster using the bounds from the previous iteration
+        A point keeps its cluster without any distance calculation when its upper bound is below
+        half the distance from its center to the closest other center, or below its lower bound(s).
+        The assignments are the same as the ones of adding_points_to_clusters
+        :param centers: k x d numpy array with the center of mass of each cluster
+        :param data: n x d numpy array of the data points
+        :param bounds: object of class 'DistanceBounds', updated in place
+        :return: numpy array with the id of the nearest cluster of each data point
+        '''
+        centers = np.asarray(centers, dtype=np.float64)
+        computed = bounds.computed
+        if bounds.labels is None:
+            # first iteration, every distance is needed to set the bounds
+            distances = self.point_center_distances(data, centers)
+            bounds.labels = np.argmin(distances, axis=1).astype(np.int32)
+            bounds.upper = distances[np.arange(len(data)), bounds.labels]
+            if bounds.method == 'elkan':
+                bounds.lower = distances
+            else:
+                distances[np.arange(len(data)), bounds.labels] = np.inf
+                bounds.lower = distances.min(axis=1)
+            bounds.computed += distances.size
+        else:
+            # moving the bounds by how far each center moved keeps them valid
+            shift = np.sqrt(((centers - bounds.centers) ** 2).sum(axis=1))
+            bounds.upper += shift[bounds.labels]
+            if bounds.method == 'elkan':
+                bounds.lower = np.maximum(bounds.lower - shift, 0)
+                self.elkan_update(centers, data, bounds)
+            else:
+                self.hamerly_update(centers, data, bounds, shift)
+        bounds.skipped += len(data) * len(centers) - (bounds.computed - computed)
+        bounds.centers = centers.copy()
+        return bounds.labels
+
+    def hamerly_update(self, centers, data, bounds, shift):
+        '''
+        Function that reassigns the points whose bounds overlap, keeping one lower bound per point
+        :param centers: k x d numpy array with the center of mass of each cluster
+        :param data: n x d numpy array of the data points
+        :param bounds: object of class 'DistanceBounds', updated in place
+        :param shift: distance moved by each center since the previous iteration
+        :return: None
+        '''
+        if len(centers) > 1:
+            # the lower bound is to the closest other center, so it drops by the largest move of another center
+            order = np.argsort(shift)
+            bounds.lower -= np.where(bounds.labels == order[-1], shift[order[-2]], shift[order[-1]])
+        half = 0.5 * self.center_distances(centers).min(axis=1)
+        limit = np.maximum(half[bounds.labels], bounds.lower)
+        candidates = np.flatnonzero(bounds.upper > limit)
+        # tighten the upper bound before calculating the distances to every center
+        bounds.upper[candidates] = np.sqrt(((data[candidates] - centers[bounds.labels[candidates]]) ** 2).sum(axis=1))
+        bounds.computed += len(candidates)
+        candidates = candidates[bounds.upper[candidates] > limit[candidates]]
+        distances = self.point_center_distances(data[candidates], centers)
+        bounds.computed += distances.size
+        labels = np.argmin(distances, axis=1)
+        bounds.labels[candidates] = labels
+        bounds.upper[candidates] = distances[np.arange(len(candidates)), labels]
+        distances[np.arange(len(candidates)), labels] = np.inf
+        bounds.lower[candidates] = distances.min(axis=1)
+
+    def elkan_update(self, centers, data, bounds):
+        '''
+        Function that reassigns the points whose bounds overlap, keeping one lower bound per point and center
+        :param centers: k x d numpy array with the center of mass of each cluster
+        :param data: n x d numpy array of the data points
+        :param bounds: object of class 'DistanceBounds', updated in place
         :return: None
         '''
-        for id in clusters_dict.keys():
-            print('>>>>>>>>>>>Id: ', id)
-            print('------------Members------------ ')
-            print(clusters_dict[id].members)
-            print('Center of mass ', clusters_dict[id].center_of_mass)
+        between = self.center_distances(centers)
+        half = 0.5 * between.min(axis=1)
+        candidates = np.flatnonzero(bounds.upper > half[bounds.labels])
+        points = data[candidates]
+        labels = bounds.labels[candidates]
+        upper = bounds.upper[candidates]
+        lower = bounds.lower[candidates]
+        # the upper bound is exact only after it has been recalculated
+        exact = np.zeros(len(candidates), dtype=bool)
+        for id in range(0, len(centers)):
+            check = (labels != id) & (upper > lower[:, id]) & (upper > 0.5 * between[labels, id])
+            tighten = np.flatnonzero(check & ~exact)
+            if len(tighten) > 0:
+                upper[tighten] = np.sqrt(((points[tighten] - centers[labels[tighten]]) ** 2).sum(axis=1))
+                lower[tighten, labels[tighten]] = upper[tighten]
+                exact[tighten] = True
+                bounds.computed += len(tighten)
+                check &= (upper > lower[:, id]) & (upper > 0.5 * between[labels, id])
+            check = np.flatnonzero(check)
+            distance = np.sqrt(((points[check] - centers[id]) ** 2).sum(axis=1))
+            bounds.computed += len(check)
+            lower[check, id] = distance
+            closer = check[distance < upper[check]]
+            labels[closer] = id
+            upper[closer] = distance[distance < upper[check]]
+        bounds.labels[candidates] = labels
+        bounds.upper[candidates] = upper
+        bounds.lower[candidates] = lower
+
+    def process_block(self, centers, data, labels, start):
+        '''
+        Function that assigns the points of one block and adds them up by cluster
+        :param centers: k x d numpy array with the center of mass of each cluster
+        :param data: n x d numpy array or memmap of the data points
+        :param labels: numpy array in which the cluster ids of the block are written
+        :param start: first row of the block
+        :return: the sse, counts and sums of the block
+        '''
+        block = np.asarray(data[start:start + self.block_size], dtype=np.float64)
+        block_labels, sse = self.adding_points_to_clusters(centers, block)
+        labels[start:start + len(block)] = block_labels
+        counts, sums = cluster_sums(block, block_labels, len(centers))
+        return sse, counts, sums
+
+    def lloyd_pass(self, centers, data):
+        '''
+        Function that makes one sequential pass over the data in blocks of block_size rows,
+        assigning every point and adding up the points of each cluster.
+        The blocks are processed by a thread pool, numpy releases the GIL during the heavy work.
+        The partial results are added in block order, so the result does not depend on n_threads
+        or on whether the data is in memory or memory-mapped
+        :param centers: k x d numpy array with the center of mass of each cluster
+        :param data: n x d numpy array or memmap of the data points
+        :return: labels, sse, counts and sums of the whole data
+        '''
+        labels = np.empty(len(data), dtype=np.int32)
+        starts = range(0, len(data), self.block_size)
+        task = partial(self.process_block, centers, data, labels)
+        if self.n_threads > 1:
+            with ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+                results = list(pool.map(task, starts))
+        else:
+            results = [task(start) for start in starts]
+        sse = 0
+        counts = np.zeros(len(centers), dtype=np.int64)
+        sums = np.zeros(centers.shape)
+        for block_sse, block_counts, block_sums in results:
+            sse += block_sse
+            counts += block_counts
+            sums += block_sums
+        return labels, sse, counts, sums
+
+    def calculate_center_of_mass(self, data, labels, centers, counts=None, sums=None):
+        '''
+        Function that calculates the center of mass of each cluster from the assignment of the points
+        A cluster that lost all its points is moved to the point that is furthest from its own center,
+        so that no cluster stays empty
+        :param data: n x d numpy array of the data points
+        :param labels: numpy array with the cluster id of each data point
+        :param centers: k x d numpy array with the centers of mass used for the assignment
+        :param counts: number of points of each cluster, calculated from the labels if not given
+        :param sums: sum of the points of each cluster, calculated from the labels if not given
+        :return: k x d numpy array with the new centers of mass
+        '''
+        if counts is None:
+            counts = np.zeros(len(centers), dtype=np.int64)
+            sums = np.zeros(centers.shape)
+            # the blocks are added in the same order as in lloyd_pass
+            for start in range(0, len(data), self.block_size):
+                block = np.asarray(data[start:start + self.block_size], dtype=np.float64)
+                block_counts, block_sums = cluster_sums(block, labels[start:start + len(block)], len(centers))
+                counts += block_counts
+                sums += block_sums
+        new_centers = centers.copy()
+        filled = counts > 0
+        new_centers[filled] = sums[filled] / counts[filled, None]
+        empty = np.flatnonzero(~filled)
+        if len(empty) > 0:
+            # the points furthest from their centers are the worst represented ones
+            errors = np.empty(len(data))
+            for start in range(0, len(data), self.block_size):
+                block = np.asarray(data[start:start + self.block_size], dtype=np.float64)
+                errors[start:start + len(block)] = ((block - centers[labels[start:start + len(block)]]) ** 2).sum(axis=1)
+            furthest = np.argsort(errors)[::-1][:len(empty)]
+            new_centers[empty] = [data[index] for index in furthest]
+        return new_centers
+
+    def centroid_shift(self, centers, new_centers):
+        '''
+        this method calculates how far each center of mass moved in an iteration
+        :param centers: k x d numpy array with the old centers of mass
+        :param new_centers: k x d numpy array with the new centers of mass
+        :return: numpy array with the euclidean distance moved by each center
+        '''
+        return np.sqrt(((new_centers - centers) ** 2).sum(axis=1))
+
+    def read_batches(self, path, batch_size):
+        '''
+        Generator that streams the csv file in batches so that only one batch is in memory
+        Records with negative values are skipped like in main
+        :param path: path of the csv file
+        :param batch_size: number of records in each batch
+        :return: yields numpy arrays of at most batch_size rows
+        '''
+        batch = []
+        with open(path) as in_file:
+            reader = csv.reader(in_file)
+            # skipping the header
+            next(reader, None)
+            for row in reader:
+                record = [float(value) for value in row]
+                if min(record) < 0:
+                    continue
+                batch.append(record)
+                if len(batch) == batch_size:
+                    yield np.array(batch)
+                    batch = []
+        if len(batch) > 0:
+            yield np.array(batch)
 
+    def reservoir_sample(self, path, size):
+        '''
+        Function that draws a uniform random sample of the records of the csv file in one streaming pass
+        Record i replaces a random element of the reservoir with probability size / (i + 1), so every
+        record has the same chance of being kept whatever the order of the file
+        :param path: path of the csv file
+        :param size: number of records to keep
+        :return: numpy array of at most size rows
+        '''
+        reservoir = None
+        seen = 0
+        for batch in self.read_batches(path, self.batch_size):
+            if reservoir is None:
+                reservoir = np.empty((size, batch.shape[1]))
+            # the first records fill the reservoir
+            filling = min(max(size - seen, 0), len(batch))
+            reservoir[seen:seen + filling] = batch[:filling]
+            # the other ones replace a random element if the draw falls inside the reservoir
+            draws = self.random_state.integers(0, np.arange(seen + filling, seen + len(batch)) + 1)
+            for row in np.flatnonzero(draws < size):
+                reservoir[draws[row]] = batch[filling + row]
+            seen += len(batch)
+        if reservoir is None:
+            return np.zeros((0, 0))
+        return reservoir[:min(seen, size)]
+
+    def form_clusters_minibatch(self, path, k):
+        '''
+        Function that forms clusters with mini-batch kmeans while streaming the csv file
+        Every center moves towards the mean of its points in the batch with a learning rate of
+        1 / (number of points assigned to it so far), so after a pass each center is the running
+        mean of the points it was given
+        :param path: path of the csv file
+        :param k: number of clusters
+        :return: sse
+        '''
+        # the initial centers are chosen from a sample of the whole file, so the order of the
+        # records does not matter and a small first batch is not a problem
+        sample = self.reservoir_sample(path, max(k, self.sample_size))
+        if len(sample) < k:
+            raise ValueError('the file has %d usable records, at least k = %d are needed' % (len(sample), k))
+        centers = self.initialize_clusters(sample, k)
+        counts = np.zeros(k)
+        for iteration in range(0, self.passes):
+            for batch in self.read_batches(path, self.batch_size):
+                labels, batch_sse = self.adding_points_to_clusters(centers, batch)
+                batch_counts = np.bincount(labels, minlength=k)
+                batch_sums = np.zeros((k, batch.shape[1]))
+                np.add.at(batch_sums, labels, batch)
+                counts += batch_counts
+                moved = batch_counts > 0
+                centers[moved] += (batch_sums[moved] - batch_counts[moved, None] * centers[moved]) / counts[moved, None]
+        # calculate sum of squared errors with one more pass over the file
+        sse = 0
+        for batch in self.read_batches(path, self.batch_size):
+            labels, batch_sse = self.adding_points_to_clusters(centers, batch)
+            sse += batch_sse
+        print('K = ', k, ' SSE = ',sse)
+        return sse
 
     def form_clusters(self, data, k):
         '''
         Function that forms clusters from individual elements
+        The iterations stop when no center of mass moves more than tol, or after max_iter iterations.
+        The shift, sse and time of every iteration are added to history. When max_iter is reached
+        first, the points are assigned once more so that the sse and labels are the ones of the
+        returned centers, after convergence they are the ones of the centers of the last iteration
         :param data: the dataset that is provided as the input
         :return: sse
         '''
-        iteration = 1
+        start_time = time.perf_counter()
+        # arrays and memmaps are read block by block, anything else is loaded into memory
+        if not isinstance(data, np.ndarray):
+            data = np.asarray(data, dtype=np.float64)
         # initialize clusters
-        clusters_dict = self.initialize_clusters(data, k)
-        # dictionary to store the old version of center of mass
-        old_clusters_dict = {}
-        # dictionary that will store new calculated center of mass
-        new_clusters_dict = copy.deepcopy(clusters_dict)
-        # while old and new centroids are not same
-        while(self.change_in_centroid_position(old_clusters_dict, new_clusters_dict)):
-            old_clusters_dict = copy.deepcopy(new_clusters_dict)
-            # add points to the clusters
-            clusters_dict = self.adding_points_to_clusters(new_clusters_dict, data)
-            # calculate center of mass
-            new_clusters_dict = self.calculate_center_of_mass(clusters_dict)
-            iteration += 1
-        # calculate sum of squared errors
-        sse = self.calculate_sse(new_clusters_dict)
-        print('K = ', k, ' SSE = ',sse)
-        #self.plot_clusters(new_clusters_dict)
+        centers = self.initialize_clusters(data, k)
+        bounds = None
+        if self.algorithm == 'hamerly' or (self.algorithm == 'auto' and k <= 20):
+            bounds = DistanceBounds('hamerly')
+        elif self.algorithm != 'lloyd':
+            bounds = DistanceBounds('elkan')
+        sse = 0
+        for iteration in range(1, self.max_iter + 1):
+            iteration_time = time.perf_counter()
+            # add points to the clusters, the sum of squared errors of the assignment comes with it
+            if bounds is None:
+                labels, sse, counts, sums = self.lloyd_pass(centers, data)
+                # calculate center of mass
+                new_centers = self.calculate_center_of_mass(data, labels, centers, counts, sums)
+            else:
+                labels = self.bounded_assignment(centers, data, bounds)
+                # the bounds skip distances, so the errors have to be calculated separately
+                sse = self.calculate_sse(data, labels, centers)
+                # calculate center of mass
+                new_centers = self.calculate_center_of_mass(data, labels, centers)
+            shift = self.centroid_shift(centers, new_centers).max()
+            centers = new_centers
+            self.history.append({'k': k, 'iteration': iteration, 'shift': shift, 'sse': sse,
+                                 'time': time.perf_counter() - iteration_time})
+            if self.verbose:
+                print('K = ', k, ' iteration ', iteration, ' shift = ', shift, ' SSE = ', sse,
+                      ' time = ', self.history[-1]['time'])
+            # stop when the centroids do not move anymore
+            if shift <= self.tol:
+                break
+        else:
+            # the centers moved in the last iteration, so the points are assigned to the final centers
+            labels, sse, _, _ = self.lloyd_pass(centers, data)
+        print('K = ', k, ' SSE = ',sse, ' iterations = ', iteration, ' time = ', time.perf_counter() - start_time)
+        if bounds is not None:
+            print('Distance calculations: ', bounds.computed, ' skipped: ', bounds.skipped)
+        self.labels = labels
+        self.centers = centers
         return sse
 
 
-    def calculate_sse(self, cluster_dict):
+    def calculate_sse(self, data, labels, centers):
         '''
         calculates the sse for given clusters
-        :param cluster_dict: generated clusters
-        :return:
+        :param data: n x d numpy array of the data points
+        :param labels: numpy array with the cluster id of each data point
+        :param centers: k x d numpy array with the center of mass of each cluster
+        :return: sum of squared distances from each point to the center of its cluster
         '''
-        sse = -1
-        for id in cluster_dict.keys():
-            com = np.array(cluster_dict[id].center_of_mass)
-            #print('Center of mass', com)
-            for member in cluster_dict[id].members:
-                temp = np.array(member)
-                #print(temp)
-                sse = sse + ((temp - com)**2).sum()
-        return sse
+        return squared_errors(data, labels, centers, self.block_size)[0].sum()
+
+    def load_binary(self, path):
+        '''
+        Function that opens a dataset stored on disk as a read-only memmap, without loading it
+        A .npy file is opened with numpy, any other file is read as raw binary made of two little-endian
+        int64 values (number of rows and columns) followed by the float32 values row after row
+        :param path: path of the file
+        :return: n x d memmap of the data points
+        '''
+        if path.endswith('.npy'):
+            return np.load(path, mmap_mode='r')
+        shape = np.fromfile(path, dtype='<i8', count=2)
+        return np.memmap(path, dtype='<f4', mode='r', offset=16, shape=(int(shape[0]), int(shape[1])))
+
+    def save_binary(self, path, data):
+        '''
+        Function that writes a dataset in the raw binary format read by load_binary
+        :param path: path of the file
+        :param data: n x d array of the data points
+        :return: None
+        '''
+        data = np.asarray(data, dtype='<f4')
+        with open(path, 'wb') as out_file:
+            np.array(data.shape, dtype='<i8').tofile(out_file)
+            data.tofile(out_file)
 
     def plot_sse_vs_k(self, sse, k):
         '''
@@ -207,10 +611,11 @@ class K_means:
         plt.plot(k, sse)
         plt.show()
 
-    def plot_clusters(self, cluster_dict):
+    def plot_clusters(self, data, labels):
         '''
         function that plots clusters in 3 dimensions
-        :param cluster_dict: generated clustes
+        :param data: n x d numpy array of the data points
+        :param labels: numpy array with the cluster id of each data point
         :return: None
         '''
         # colors used to represent different clusters
@@ -219,37 +624,195 @@ class K_means:
         sym = ['^', 'o', '*', '+', 'x']
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
-        for id in cluster_dict.keys():
+        for id in np.unique(labels):
             c = colors[id%10]
             s = sym[id%4]
-            for row in cluster_dict[id].members:
-                ax.scatter(row[0], row[1], row[2], color=c, marker=s)
+            members = data[labels == id]
+            ax.scatter(members[:, 0], members[:, 1], members[:, 2], color=c, marker=s)
         plt.show()
 
-    def remove_noise(self, data):
+    def count_neighbors(self, data, radius):
         '''
-        function that removes the noise if any
+        Function that counts the points within radius of every point using a grid hash
+        The space is divided into cells of side radius, so the neighbors of a point can only be in
+        its own cell or in one of the 3^d cells around it. The cost is expected O(n) for a fixed
+        density, with a 3^d factor that makes it best suited to low-dimensional data
+        :param data: n x d numpy array of the data points
+        :param radius: distance within which two points are neighbors
+        :return: numpy array with the number of neighbors of each point, not counting the point itself
+        '''
+        data = np.asarray(data, dtype=np.float64)
+        index = CellIndex(data, radius, 1, radius, inclusive=True, chunk_size=self.chunk_size)
+        points = np.arange(len(data))
+        counts = np.zeros(len(data), dtype=np.int64)
+        for offset in itertools.product((-1, 0, 1), repeat=data.shape[1]):
+            for first, second in index.pairs(points, np.array(offset)):
+                counts += np.bincount(first, minlength=len(data))
+        # every point was counted as its own neighbor
+        return counts - 1
+
+    def remove_noise(self, data, radius=1.0, min_neighbors=9):
+        '''
+        function that finds the noise, the points that have fewer than min_neighbors points within radius
         :param data: input data
-        :return: None
+        :param radius: distance within which two points are neighbors
+        :param min_neighbors: minimum number of neighbors of a point that is kept
+        :return: boolean numpy array that is True for the points to keep
+        '''
+        return self.count_neighbors(data, radius) >= min_neighbors
+
+    def silhouette_score(self, data, labels):
+        '''
+        Function that estimates the mean silhouette of the points on a random sample of sample_size points
+        The distances within the sample are calculated chunk_size rows at a time and summed by cluster
+        with a matrix product, so the memory used is bounded by chunk_size x sample_size
+        :param data: n x d numpy array of the data points
+        :param labels: numpy array with the cluster id of each data point
+        :return: mean silhouette of the sampled points, between -1 and 1
+        '''
+        if len(data) > self.sample_size:
+            sample = np.sort(self.random_state.choice(len(data), self.sample_size, replace=False))
+        else:
+            sample = np.arange(len(data))
+        points = np.asarray(data[sample], dtype=np.float64)
+        sample_labels = labels[sample]
+        k = int(labels.max()) + 1
+        counts = np.bincount(sample_labels, minlength=k)
+        one_hot = np.zeros((len(sample), k))
+        one_hot[np.arange(len(sample)), sample_labels] = 1
+        silhouette = np.zeros(len(sample))
+        for start in range(0, len(sample), self.chunk_size):
+            chunk = points[start:start + self.chunk_size]
+            chunk_labels = sample_labels[start:start + len(chunk)]
+            squared = (chunk ** 2).sum(axis=1)[:, None] - 2 * (chunk @ points.T) + (points ** 2).sum(axis=1)
+            # sum of the distances from each point of the chunk to the points of each cluster
+            totals = np.sqrt(np.maximum(squared, 0)) @ one_hot
+            rows = np.arange(len(chunk))
+            own = counts[chunk_labels] - 1
+            # the point itself is in its own cluster but at distance 0
+            inside = totals[rows, chunk_labels] / np.maximum(own, 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                means = totals / counts
+            means[rows, chunk_labels] = np.inf
+            means[:, counts == 0] = np.inf
+            outside = means.min(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                value = (outside - inside) / np.maximum(inside, outside)
+            # a point alone in its cluster has a silhouette of 0
+            silhouette[start:start + len(chunk)] = np.where(own > 0, np.nan_to_num(value), 0)
+        return silhouette.mean()
+
+    def calculate_scores(self, data, labels, centers):
+        '''
+        Function that calculates the quality scores of a clustering
+        Calinski-Harabasz and Davies-Bouldin only need the centers and one pass over the data, O(n.k)
+        :param data: n x d numpy array of the data points
+        :param labels: numpy array with the cluster id of each data point
+        :param centers: k x d numpy array with the center of mass of each cluster
+        :return: dictionary with the 'silhouette' (higher is better), 'calinski_harabasz' (higher is better)
+        and 'davies_bouldin' (lower is better) scores
+        '''
+        k = len(centers)
+        counts = np.bincount(labels, minlength=k)
+        # distance from each point to its center, summed and squared-summed by cluster
+        distance_sums = np.zeros(k)
+        squared_sums = np.zeros(k)
+        for start in range(0, len(data), self.block_size):
+            block = np.asarray(data[start:start + self.block_size], dtype=np.float64)
+            block_labels = labels[start:start + len(block)]
+            squared = ((block - centers[block_labels]) ** 2).sum(axis=1)
+            distance_sums += np.bincount(block_labels, weights=np.sqrt(squared), minlength=k)
+            squared_sums += np.bincount(block_labels, weights=squared, minlength=k)
+        mean = (counts[:, None] * centers).sum(axis=0) / counts.sum()
+        between = (counts * ((centers - mean) ** 2).sum(axis=1)).sum()
+        within = squared_sums.sum()
+        if within == 0 or k < 2:
+            calinski_harabasz = np.inf
+        else:
+            calinski_harabasz = (between / (k - 1)) / (within / (len(data) - k))
+        # average distance from the points of each cluster to its center
+        spread = distance_sums / np.maximum(counts, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = (spread[:, None] + spread[None, :]) / self.center_distances(centers)
+        davies_bouldin = np.nan_to_num(ratio).max(axis=1).mean()
+        return {'silhouette': self.silhouette_score(data, labels),
+                'calinski_harabasz': calinski_harabasz,
+                'davies_bouldin': davies_bouldin}
+
+    def choose_k(self, scores):
+        '''
+        Function that chooses the best k from the scores of each k using the selection score
+        :param scores: dictionary mapping each k to its scores
+        :return: the chosen k
+        '''
+        if self.selection == 'davies_bouldin':
+            return min(scores, key=lambda k: scores[k][self.selection])
+        return max(scores, key=lambda k: scores[k][self.selection])
+
+    def sweep(self, data, k_values):
+        '''
+        Function that forms clusters for every value of k, restarts times each, and keeps the lowest sse
+        With more than one job the runs are spread over a process pool. The dataset is copied once
+        into a shared memory block that every worker reads instead of receiving its own copy.
+        The runs only give back their sse and centers, the run with the lowest sse of each k is
+        then assigned and scored once, whatever the number of jobs
+        :param data: the dataset that is provided as the input
+        :param k_values: the values of k to try
+        :return: list with the lowest sse of each value of k, the scores, labels and centers of the run
+        with the lowest sse are kept in scores, sweep_labels and sweep_centers, the k chosen from the
+        scores in best_k, and labels and centers are set to the ones of that k
         '''
-        for row in range(0,len(data)):
-            count = 0
-            x1 = data[row][0]
-            y1 = data[row][1]
-            z1 = data[row][2]
-            while count<10:
-                for inner_row in range(0,len(data)):
-                    x2 = data[inner_row][0]
-                    y2 = data[inner_row][1]
-                    z2 = data[inner_row][2]
-                    #print(x1, y1, z1, x2, y2, z2)
-                    dist = math.sqrt((x1 - x2)**2 + (y1 - y2)**2 + (z1 - z2)**2)
-                    #print(dist)
-                    if dist > 1:
-                        count += 1
-            if count < 9:
-                #print('Row ', row, ' removed')
-                data.remove(row)
+        start_time = time.perf_counter()
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        k_values = list(k_values)
+        # every run gets its own seed so that the sweep is reproducible for a given seed
+        seeds = np.random.SeedSequence(self.seed).spawn(len(k_values) * self.restarts)
+        runs = [(k, seeds[num * self.restarts + restart]) for num, k in enumerate(k_values) for restart in range(0, self.restarts)]
+        best = dict((k, np.inf) for k in k_values)
+        best_seeds = {}
+        self.scores = {}
+        self.sweep_labels = {}
+        self.sweep_centers = {}
+        if self.n_jobs <= 1:
+            for k, seed in runs:
+                self.random_state = np.random.default_rng(seed)
+                sse = self.form_clusters(data, k)
+                if sse < best[k]:
+                    best[k] = sse
+                    best_seeds[k] = seed
+                    self.sweep_centers[k] = self.centers
+        else:
+            memory = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+            try:
+                shared = np.ndarray(data.shape, dtype=data.dtype, buffer=memory.buf)
+                shared[:] = data
+                with ProcessPoolExecutor(max_workers=self.n_jobs, initializer=init_sweep_worker,
+                                         initargs=(memory.name, data.shape, data.dtype.str, self)) as pool:
+                    jobs = [pool.submit(run_sweep, k, seed) for k, seed in runs]
+                    for job, (_, seed) in zip(jobs, runs):
+                        k, sse, centers = job.result()
+                        if sse < best[k]:
+                            best[k] = sse
+                            best_seeds[k] = seed
+                            self.sweep_centers[k] = centers
+                # the array has to be dropped before the buffer can be closed
+                del shared
+            finally:
+                memory.close()
+                memory.unlink()
+        for k in k_values:
+            # the silhouette sample is drawn from the seed of the run, so it is the same for any number of jobs
+            self.random_state = np.random.default_rng(best_seeds[k])
+            self.sweep_labels[k], _ = self.adding_points_to_clusters(self.sweep_centers[k], data)
+            self.scores[k] = self.calculate_scores(data, self.sweep_labels[k], self.sweep_centers[k])
+        self.best_k = self.choose_k(self.scores)
+        self.labels = self.sweep_labels[self.best_k]
+        self.centers = self.sweep_centers[self.best_k]
+        print('Sweep over k = ', k_values, ' took ', time.perf_counter() - start_time)
+        for k in k_values:
+            print('K = ', k, ' SSE = ', best[k], ' scores: ', self.scores[k])
+        print('Best K by ', self.selection, ': ', self.best_k)
+        return [best[k] for k in k_values]
 
     def main(self):
         '''
@@ -258,6 +821,13 @@ class K_means:
         '''
         # path of the csv file
         path = 'C:/abc.csv'
+        if self.batch_size is not None:
+            # the file is streamed in batches, so it is never loaded as a whole
+            sse = []
+            for k in range(2, 11):
+                sse.append(self.form_clusters_minibatch(path, k))
+            self.plot_sse_vs_k(sse, list(range(2, 11)))
+            return
         # read the file into a list
         input_file = list(csv.reader(open(path)))
         # initialize an empty list
@@ -278,17 +848,53 @@ class K_means:
         # removing headers
         data.pop(0)
         # remove noise
-        self.remove_noise(data)
+        data = np.array(data)
+        data = data[self.remove_noise(data)]
         print(len(data))
         # forming clusters for multiple values of k
         #for iter in range(0, 6):
-        sse = []
-        for k in range(2, 11):
-            sse.append(self.form_clusters(data, k))
+        sse = self.sweep(data, range(2, 11))
+        # summary of the clusters of the lowest sse run for the chosen k
+        print(summary_table(cluster_statistics(data, self.labels, self.best_k)))
         self.plot_sse_vs_k(sse, list(range(2, 11)))
         #plt.show()
 
-# creating an object of type 'K_means'
-kmeans = K_means()
-# call to the main function
-kmeans.main()
+
+# dataset and K_means object used by the worker processes of the sweep, set by init_sweep_worker
+worker_memory = None
+worker_data = None
+worker_kmeans = None
+
+
+def init_sweep_worker(name, shape, dtype, kmeans):
+    '''
+    Function that attaches a worker process to the shared memory block holding the dataset
+    :param name: name of the shared memory block
+    :param shape: shape of the dataset
+    :param dtype: type of the dataset
+    :param kmeans: the K_means object whose settings are used
+    :return: None
+    '''
+    global worker_memory, worker_data, worker_kmeans
+    worker_memory = shared_memory.SharedMemory(name=name)
+    worker_data = np.ndarray(shape, dtype=dtype, buffer=worker_memory.buf)
+    worker_kmeans = kmeans
+
+
+def run_sweep(k, seed):
+    '''
+    Function run by a worker process that forms clusters for one value of k from one seed
+    :param k: number of clusters
+    :param seed: seed of the random generator used to choose the initial centers
+    :return: k, the sse and the centers of mass
+    '''
+    worker_kmeans.random_state = np.random.default_rng(seed)
+    sse = worker_kmeans.form_clusters(worker_data, k)
+    return k, sse, worker_kmeans.centers
+
+
+if __name__ == '__main__':
+    # creating an object of type 'K_means', the sweep over k uses every core
+    kmeans = K_means(restarts=5, n_jobs=os.cpu_count())
+    # call to the main function
+    kmeans.main()
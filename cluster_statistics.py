@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+
+def cluster_sums(block, labels, k):
+    '''
+    Function that counts and sums the points of each cluster in a block, one column at a time with bincount
+    :param block: m x d numpy array of data points
+    :param labels: numpy array with the cluster id of each point of the block
+    :param k: number of clusters
+    :return: counts: number of points of each cluster
+             sums: k x d numpy array with the sum of the points of each cluster
+    '''
+    counts = np.bincount(labels, minlength=k)
+    sums = np.empty((k, block.shape[1]))
+    for col in range(0, block.shape[1]):
+        sums[:, col] = np.bincount(labels, weights=block[:, col], minlength=k)
+    return counts, sums
+
+
+def squared_errors(data, labels, centers, block_size=65536):
+    '''
+    Function that calculates the squared distance from each point to the center of its cluster
+    and adds them up by cluster, a block of rows at a time so the data can be a memmap
+    :param data: n x d numpy array or memmap of the data points
+    :param labels: numpy array with the cluster id of each data point, the points with a negative id are skipped
+    :param centers: k x d numpy array with the center of each cluster
+    :param block_size: number of rows read at once
+    :return: sse: numpy array with the sum of squared distances of each cluster
+             radius: numpy array with the largest distance from the center of each cluster to one of its points
+    '''
+    sse = np.zeros(len(centers))
+    squared_radius = np.zeros(len(centers))
+    for start in range(0, len(data), block_size):
+        block = np.asarray(data[start:start + block_size], dtype=np.float64)
+        block_labels = labels[start:start + len(block)]
+        inside = block_labels >= 0
+        block = block[inside]
+        block_labels = block_labels[inside]
+        errors = ((block - centers[block_labels]) ** 2).sum(axis=1)
+        sse += np.bincount(block_labels, weights=errors, minlength=len(centers))
+        np.maximum.at(squared_radius, block_labels, errors)
+    return sse, np.sqrt(squared_radius)
+
+
+def cluster_statistics(data, labels, k=None, block_size=65536):
+    '''
+    Function that calculates the statistics of every cluster from the data and the cluster id of each point
+    The sizes, sums and bounding boxes are added up by cluster in a first pass over the data and
+    the errors around the centroids in a second one, both a block of rows at a time
+    :param data: n x d numpy array or memmap of the data points
+    :param labels: numpy array with the cluster id (0 to k-1) of each data point, -1 for noise
+    :param k: number of clusters, the largest id + 1 if not given
+    :param block_size: number of rows read at once
+    :return: dictionary with, for each cluster, the 'size', the 'centroid', the 'sse', the 'radius'
+             (largest distance from the centroid to a point) and the 'lower' and 'upper' corners of its bounding box
+    '''
+    labels = np.asarray(labels, dtype=np.int64)
+    if k is None:
+        k = int(labels.max()) + 1 if len(labels) else 0
+    dimensions = np.shape(data)[1]
+    sizes = np.zeros(k, dtype=np.int64)
+    sums = np.zeros((k, dimensions))
+    lower = np.full((k, dimensions), np.inf)
+    upper = np.full((k, dimensions), -np.inf)
+    for start in range(0, len(data), block_size):
+        block = np.asarray(data[start:start + block_size], dtype=np.float64)
+        block_labels = labels[start:start + len(block)]
+        inside = block_labels >= 0
+        block = block[inside]
+        block_labels = block_labels[inside]
+        block_sizes, block_sums = cluster_sums(block, block_labels, k)
+        sizes += block_sizes
+        sums += block_sums
+        np.minimum.at(lower, block_labels, block)
+        np.maximum.at(upper, block_labels, block)
+    centroids = np.full((k, dimensions), np.nan)
+    filled = sizes > 0
+    centroids[filled] = sums[filled] / sizes[filled, None]
+    sse, radius = squared_errors(data, labels, np.nan_to_num(centroids), block_size)
+    return {'size': sizes, 'centroid': centroids, 'sse': sse, 'radius': radius, 'lower': lower, 'upper': upper}
+
+
+def summary_table(statistics, decimals=2):
+    '''
+    Function that builds a dataframe with one row per cluster from the statistics, all at once
+    :param statistics: dictionary returned by cluster_statistics
+    :param decimals: number of decimal places of the coordinates
+    :return: dataframe with the columns 'cluster no', 'no of elements', 'center of mass', 'sse',
+             'radius', 'lower bound' and 'upper bound'
+    '''
+    return pd.DataFrame({'cluster no': np.arange(len(statistics['size'])),
+                         'no of elements': statistics['size'],
+                         'center of mass': np.round(statistics['centroid'], decimals).tolist(),
+                         'sse': statistics['sse'],
+                         'radius': statistics['radius'],
+                         'lower bound': np.round(statistics['lower'], decimals).tolist(),
+                         'upper bound': np.round(statistics['upper'], decimals).tolist()})
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def cell_keys(cells, extents):
+    '''
+    Function that turns the integer grid coordinates of each point into a single sortable key
+    :param cells: n x d numpy array of non-negative integer grid coordinates
+    :param extents: number of cells along each dimension
+    :return: numpy array of n keys, equal keys mean equal cells
+    '''
+    cells = np.ascontiguousarray(cells, dtype=np.int64)
+    if np.prod(np.asarray(extents, dtype=np.float64)) < 2 ** 62:
+        # the cells are numbered like the elements of an array with shape extents
+        radix = np.concatenate(([1], np.cumprod(extents[:-1])))
+        return cells @ radix
+    # too many cells for an integer key, compare the raw bytes of the coordinates instead
+    return cells.view(np.dtype((np.void, cells.dtype.itemsize * cells.shape[1]))).ravel()
+
+
+class CellIndex:
+    '''
+    Class that buckets the data points into the cells of a grid of the given side, the points are sorted by
+    cell so that the points of a cell are a contiguous range of 'order'. Two points are neighbors
+    when they are closer than radius (or at most radius apart when inclusive is True), pairs finds
+    them between each query point and the cell at an offset from its own cell
+    '''
+    def __init__(self, data, side, reach, radius, inclusive=False, chunk_size=4096):
+        self.data = np.ascontiguousarray(data, dtype=np.float64)
+        self.side = side
+        self.radius = radius
+        self.inclusive = inclusive
+        self.chunk_size = chunk_size
+        cells = np.floor(self.data / side).astype(np.int64)
+        # leave reach empty cells on each side so that the neighboring cells are never negative
+        self.cells = cells - (cells.min(axis=0) - reach)
+        self.extents = self.cells.max(axis=0) + reach + 1
+        self.cell_ids, cell_of_point = np.unique(cell_keys(self.cells, self.extents), return_inverse=True)
+        self.cell_of_point = cell_of_point.ravel()
+        # the points sorted by cell, with the position of the first point of every cell
+        self.order = np.argsort(self.cell_of_point, kind='stable')
+        self.cell_sizes = np.bincount(self.cell_of_point, minlength=len(self.cell_ids))
+        self.cell_starts = np.concatenate(([0], np.cumsum(self.cell_sizes)[:-1]))
+        # grid coordinates of each cell
+        self.cell_coords = self.cells[self.order[self.cell_starts]]
+
+    def neighbor_cells(self, offset):
+        '''
+        Function that finds, for every cell, the cell at the given offset from it
+        :param offset: numpy array with the offset of the cell along each dimension
+        :return: numpy array with the index of the neighboring cell of each cell, -1 if it is empty
+        '''
+        keys = cell_keys(self.cell_coords + offset, self.extents)
+        position = np.minimum(np.searchsorted(self.cell_ids, keys), len(self.cell_ids) - 1)
+        return np.where(self.cell_ids[position] == keys, position, -1)
+
+    def pairs(self, queries, offset):
+        '''
+        Generator of the pairs of neighbors between the query points and the points of the cell at
+        the given offset from each query point
+        :param queries: numpy array of indices of query points
+        :param offset: numpy array with the offset of the cell along each dimension
+        :return: yields numpy arrays of query indices and point indices, one block at a time
+        '''
+        position = self.neighbor_cells(offset)[self.cell_of_point[queries]]
+        found = np.flatnonzero(position >= 0)
+        for start in range(0, len(found), self.chunk_size):
+            block = found[start:start + self.chunk_size]
+            sizes = self.cell_sizes[position[block]]
+            # one pair for every query point of the block and every point in its neighboring cell
+            first = np.repeat(queries[block], sizes)
+            within = np.arange(len(first)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            second = self.order[np.repeat(self.cell_starts[position[block]], sizes) + within]
+            distance = np.sqrt(((self.data[first] - self.data[second]) ** 2).sum(axis=1))
+            close = distance <= self.radius if self.inclusive else distance < self.radius
+            yield first[close], second[close]